@@ -0,0 +1,83 @@
+# Measure contention on a Collection between pollers that sweep all the resources,
+# a thread that adds and deletes resources, and REST readers that serialize the collection.
+# The "locked" mode holds the collection lock for each sweep as the poll loops used to do,
+# the "snapshot" mode iterates the copy-on-write membership snapshot without the lock.
+
+import sys
+import os
+import time
+import json
+import threading
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from homealone import *
+
+nResources = 1000
+nPollers = 4
+nReaders = 2
+runTime = 3.0
+readDelay = .00001     # simulated hardware read time in seconds
+
+class DelayInterface(Interface):
+    def read(self, addr):
+        time.sleep(readDelay)
+        return addr
+
+def runMode(mode):
+    interface = DelayInterface("delay")
+    resources = Collection("resources", [Sensor("sensor%d" % i, interface, i) for i in range(nResources)])
+    stop = threading.Event()
+    counts = {"sweeps": 0, "churn": 0, "dumps": 0}
+    churnTimes = []
+
+    def sweep():
+        if mode == "locked":
+            with resources.lock:
+                for resource in list(resources.values()):
+                    resource.getState()
+        else:
+            for resource in resources.members():
+                resource.getState()
+
+    def poller():
+        while not stop.is_set():
+            sweep()
+            counts["sweeps"] += 1
+
+    def churn():
+        n = 0
+        while not stop.is_set():
+            startTime = time.perf_counter()
+            resources.addRes(Sensor("churn%d" % n, interface, n))
+            resources.delRes("churn%d" % n)
+            churnTimes.append(time.perf_counter() - startTime)
+            counts["churn"] += 1
+            n += 1
+            time.sleep(.001)
+
+    def reader():
+        while not stop.is_set():
+            resources.dumpJson()
+            counts["dumps"] += 1
+
+    threads = [threading.Thread(target=poller) for i in range(nPollers)] + \
+              [threading.Thread(target=reader) for i in range(nReaders)] + \
+              [threading.Thread(target=churn)]
+    for thread in threads:
+        thread.start()
+    time.sleep(runTime)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    churnTimes.sort()
+    return {"sweepsPerSec": counts["sweeps"] / runTime,
+            "churnPerSec": counts["churn"] / runTime,
+            "dumpsPerSec": counts["dumps"] / runTime,
+            "churnMedianMs": churnTimes[len(churnTimes) // 2] * 1e3 if churnTimes else None,
+            "churnMaxMs": churnTimes[-1] * 1e3 if churnTimes else None}
+
+def run():
+    return {mode: runMode(mode) for mode in ["locked", "snapshot"]}
+
+if __name__ == "__main__":
+    print(json.dumps({"benchmark": "collectionContention", "resources": nResources,
+                      "pollers": nPollers, "readers": nReaders, "results": run()}, indent=4))
@@ -0,0 +1,123 @@
+# Benchmarks of the core resource, collection and state cache operations
+
+import sys
+import os
+import time
+import json
+import threading
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from homealone import *
+from homealone.interfaces.testInterface import TestInterface
+
+sizes = [100, 1000, 10000]
+nGroups = 10
+
+# an interface whose values change every time a sweep starts
+class CountInterface(TestInterface):
+    def __init__(self, name, event=None):
+        TestInterface.__init__(self, name, event=event)
+        self.count = 0
+
+    def read(self, addr):
+        return self.count + addr
+
+def makeSensors(n, interface, event=None):
+    return [Sensor("sensor%d" % i, interface, i, group="group%d" % (i % nGroups), event=event) for i in range(n)]
+
+# run a function repeatedly for at least the specified time and return the average time in seconds
+def timeit(function, minTime=.2, minCount=3):
+    count = 0
+    startTime = time.perf_counter()
+    while True:
+        function()
+        count += 1
+        elapsed = time.perf_counter() - startTime
+        if (elapsed >= minTime) and (count >= minCount):
+            return elapsed / count
+
+def benchGetState():
+    sensors = makeSensors(1000, TestInterface("test"))
+    def getStates():
+        for sensor in sensors:
+            sensor.getState()
+    return {"nsPerGetState": timeit(getStates) * 1e9 / len(sensors)}
+
+def benchCollection(n):
+    interface = TestInterface("test")
+    sensors = makeSensors(n, interface)
+    def addRes():
+        Collection("resources").addRes(sensors)
+    resources = Collection("resources", sensors)
+    def dumpJson():     # serialize without the cached documents
+        resources.changed()
+        resources.fragments.clear()
+        resources.dumpJson(True)
+    return {"msAddRes": timeit(addRes) * 1e3,
+            "usGetGroup": timeit(lambda: resources.getGroup("group1")) * 1e6,
+            "msDump": timeit(lambda: resources.dump(True)) * 1e3,
+            "msDumpJson": timeit(dumpJson) * 1e3,
+            "usDumpJsonCached": timeit(lambda: resources.dumpJson(True)) * 1e6}
+
+def benchPollSweep(n):
+    interface = CountInterface("count")
+    sensors = makeSensors(n, interface)
+    cache = StateCache("states", Collection("resources", sensors), ResourceEvent())
+    def sweep():
+        interface.count += 1
+        cache.updateStates(cache.changedStates(cache.readStates(sensors), "debugBenchmark"))
+    sweepTime = timeit(sweep)
+    return {"msPerSweep": sweepTime * 1e3, "resourcesPerSec": n / sweepTime}
+
+# start the event thread of a cache and return a function that sets the event and waits for the states
+def eventCache(n):
+    event = ResourceEvent()
+    interface = CountInterface("count", event=event)
+    sensors = makeSensors(n, interface, event=event)
+    cache = StateCache("states", Collection("resources", sensors), event)
+    cache.updateStates(cache.readStates(sensors))
+    thread = threading.Thread(target=cache.watchEventsThread, daemon=True)
+    thread.start()
+    def notify(source):
+        interface.count += 1
+        cache.stateEvent.clear()
+        if source:
+            source.notify()
+        else:
+            event.set()
+        cache.stateEvent.wait()
+    return (sensors, notify)
+
+def benchEventSweep(n):
+    (sensors, notify) = eventCache(n)
+    sweepTime = timeit(lambda: notify(None))      # the event doesn't identify the source so all are read
+    return {"msPerSweep": sweepTime * 1e3, "resourcesPerSec": n / sweepTime}
+
+def benchNotifyLatency(n):
+    (sensors, notify) = eventCache(n)
+    latencies = []
+    for i in range(200):
+        startTime = time.perf_counter()
+        notify(sensors[i % n])
+        latencies.append(time.perf_counter() - startTime)
+    latencies.sort()
+    return {"usMedian": latencies[len(latencies) // 2] * 1e6,
+            "usP95": latencies[int(len(latencies) * .95)] * 1e6,
+            "usMax": latencies[-1] * 1e6}
+
+def benchDiffStates(n):
+    old = {"sensor%d" % i: i for i in range(n)}
+    new = {"sensor%d" % i: (i + 1 if i % 10 == 0 else i) for i in range(n)}
+    return {"usDiffStates": timeit(lambda: diffStates(old, new)) * 1e6}
+
+def run():
+    results = {"getState": benchGetState()}
+    for (name, function) in [("collection", benchCollection),
+                             ("pollSweep", benchPollSweep),
+                             ("eventSweep", benchEventSweep),
+                             ("notifyLatency", benchNotifyLatency),
+                             ("diffStates", benchDiffStates)]:
+        results[name] = {str(n): function(n) for n in sizes}
+    return results
+
+if __name__ == "__main__":
+    print(json.dumps({"benchmark": "core", "results": run()}, indent=4))
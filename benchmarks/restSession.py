@@ -0,0 +1,81 @@
+# Measure the latency and throughput of control writes to a RemoteService with a new connection for every
+# request and with the connection pool of a RestInterface
+# The HTTP server of a RemoteService closes the connection after every response, so the pool can't reuse
+# connections yet and the only difference is that the RestInterface doesn't create a session for every request
+
+import sys
+import os
+import time
+import json
+import concurrent.futures
+import multiprocessing
+import requests
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from homealone import *
+from homealone.remote.restInterface import RestInterface
+from homealone.remote.remoteService import RemoteService
+
+nWrites = 500
+nThreads = 4
+nControls = 10
+
+class MemoryInterface(Interface):
+    def read(self, addr):
+        return self.states.get(addr)
+
+    def write(self, addr, value):
+        self.states[addr] = value
+        self.notify()
+        return True
+
+# write the state of a control with a new connection like the previous RestInterface
+def newConnectionWrite(serviceAddr, path, data):
+    requests.put("http://"+serviceAddr+path, headers={"Content-type":"application/json"}, data=data, timeout=restTimeout)
+
+# return the write latencies and throughput of a write function called from the specified number of threads
+def timeWrites(write, threads):
+    latencies = []
+    def timedWrite(i):
+        startTime = time.perf_counter()
+        write("/resources/control%d/state" % (i % nControls), json.dumps({"state": i % 2}))
+        latencies.append(time.perf_counter() - startTime)
+    startTime = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(threads) as executor:
+        list(executor.map(timedWrite, range(nWrites)))
+    elapsed = time.perf_counter() - startTime
+    latencies.sort()
+    return {"meanMs": sum(latencies) * 1000 / len(latencies),
+            "p50Ms": latencies[len(latencies) // 2] * 1000,
+            "p99Ms": latencies[int(len(latencies) * .99)] * 1000,
+            "writesPerSec": nWrites / elapsed}
+
+# run a RemoteService with controls that store their states in memory and send its port to the queue
+def runService(portQueue):
+    event = ResourceEvent()
+    interface = MemoryInterface("memoryInterface", event=event)
+    resources = Collection("resources", [Control("control%d" % i, interface, i) for i in range(nControls)])
+    service = RemoteService("benchmarkService", resources, StateCache("states", resources, event), advert=False)
+    service.start(block=False)
+    portQueue.put(service.port)
+    while True:
+        time.sleep(1)
+
+def run():
+    # the service runs in its own process like it would on a server
+    portQueue = multiprocessing.Queue()
+    serviceProcess = multiprocessing.Process(target=runService, args=(portQueue,), daemon=True)
+    serviceProcess.start()
+    serviceAddr = "127.0.0.1:%d" % portQueue.get()
+    restInterface = RestInterface("benchmarkInterface", serviceAddr=serviceAddr)
+    results = {}
+    for threads in (1, nThreads):
+        results["%dThreads" % threads] = {
+            "newConnection": timeWrites(lambda path, data: newConnectionWrite(serviceAddr, path, data), threads),
+            "sessionPool": timeWrites(restInterface.writeRest, threads)}
+    restInterface.closeSession()
+    serviceProcess.terminate()
+    serviceProcess.join()
+    return results
+
+if __name__ == "__main__":
+    print(json.dumps({"benchmark": "restSession", "writes": nWrites, "results": run()}, indent=4))
@@ -0,0 +1,48 @@
+# Run the benchmarks and write the results as a JSON document
+#
+#   python benchmarks/run.py [-o results.json] [benchmark ...]
+#
+# Each benchmark is a module in this directory with a run() function that returns a dictionary of results.
+
+import sys
+import os
+import time
+import json
+import platform
+import argparse
+import importlib
+import subprocess
+
+benchmarkDir = os.path.dirname(os.path.abspath(__file__))
+benchmarks = ["core", "sensorAttrs", "collectionContention", "tracing", "stateEncoding", "restSession"]
+
+# return the commit of the source tree if it is a git repository
+def gitCommit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=benchmarkDir,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the Homealone benchmarks")
+    parser.add_argument("benchmarks", nargs="*", default=benchmarks, help="benchmarks to run")
+    parser.add_argument("-o", "--output", help="file to write the results to instead of stdout")
+    args = parser.parse_args()
+    sys.path.insert(0, benchmarkDir)
+    results = {}
+    for benchmark in args.benchmarks:
+        startTime = time.time()
+        results[benchmark] = importlib.import_module(benchmark).run()
+        print(benchmark, "%.1f seconds" % (time.time() - startTime), file=sys.stderr)
+    document = json.dumps({"time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                           "commit": gitCommit(),
+                           "python": platform.python_version(),
+                           "platform": platform.platform(),
+                           "machine": platform.machine(),
+                           "results": results}, indent=4)
+    if args.output:
+        with open(args.output, "w") as outputFile:
+            outputFile.write(document+"\n")
+    else:
+        print(document)
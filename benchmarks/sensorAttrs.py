@@ -0,0 +1,100 @@
+# Compare the memory footprint and attribute access time of Sensor objects
+# with the previous implementation that overrode __getattribute__ and __setattr__
+
+import sys
+import os
+import time
+import json
+import tracemalloc
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from homealone import *
+
+nResources = 10000
+nLoops = 10
+
+# the previous implementation of the state attribute on top of a Resource with a __dict__
+class LegacySensor(object):
+    def __init__(self, name, interface=None, addr=None, type="sensor", event=None,
+                 factor=1, offset=0, resolution=0, states=None,
+                 poll=10, persistence=None, interrupt=None,
+                 label="", group="", location=None):
+        self.className = self.__class__.__name__
+        self.name = name
+        self.event = event
+        self.enabled = True
+        self.collections = {}
+        self.interface = interface
+        self.addr = addr
+        self.type = type
+        self.resolution = resolution
+        self.factor = factor
+        self.offset = offset
+        self.states = states
+        self.poll = poll
+        self.persistence = persistence
+        self.interrupt = interrupt
+        self.deadband = None
+        self.relDeadband = None
+        self.minInterval = None
+        self.heartbeat = None
+        self.maxAge = None
+        self.minPoll = None
+        self.maxPoll = None
+        self.location = location
+        self.group = listize(group)
+        self.label = label
+        self.__dict__["state"] = None
+
+    getState = Sensor.getState
+    convertState = Sensor.convertState
+    setState = Sensor.setState
+
+    def __getattribute__(self, attr):
+        if attr == "state":
+            return self.getState()
+        else:
+            return object.__getattribute__(self, attr)
+
+    def __setattr__(self, attr, value):
+        if attr == "state":
+            self.setState(value)
+        else:
+            object.__setattr__(self, attr, value)
+
+# return the number of bytes allocated per object
+def footprint(sensorClass):
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    sensors = [sensorClass("sensor%d" % i, group="group%d" % (i % 10)) for i in range(nResources)]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return (after - before) / nResources
+
+# return the time in nanoseconds of one attribute access
+def accessTime(sensorClass, attr):
+    sensors = [sensorClass("sensor%d" % i, group="group%d" % (i % 10)) for i in range(nResources)]
+    startTime = time.perf_counter()
+    for loop in range(nLoops):
+        for sensor in sensors:
+            getattr(sensor, attr)
+    return (time.perf_counter() - startTime) * 1e9 / (nLoops * nResources)
+
+# return the time in milliseconds to find the members of a group
+def groupTime(sensorClass):
+    sensors = [sensorClass("sensor%d" % i, group="group%d" % (i % 10)) for i in range(nResources)]
+    startTime = time.perf_counter()
+    for loop in range(nLoops):
+        [sensor for sensor in sensors if "group1" in sensor.group]
+    return (time.perf_counter() - startTime) * 1e3 / nLoops
+
+def run():
+    results = {}
+    for (label, sensorClass) in [("legacy", LegacySensor), ("current", Sensor)]:
+        results[label] = {"bytesPerSensor": footprint(sensorClass),
+                          "nsPerNameAccess": accessTime(sensorClass, "name"),
+                          "nsPerStateAccess": accessTime(sensorClass, "state"),
+                          "msPerGroupScan": groupTime(sensorClass)}
+    return results
+
+if __name__ == "__main__":
+    print(json.dumps({"benchmark": "sensorAttrs", "resources": nResources, "results": run()}, indent=4))
@@ -0,0 +1,54 @@
+# Compare the JSON and packed encodings of resource states as they are sent by a service and decoded by a client
+
+import sys
+import os
+import time
+import json
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from homealone import *
+from homealone.remote.restInterface import numericKeys2Int
+from homealone.remote.stateEncoding import *
+
+nResources = 1000
+nLoops = 200
+
+# states of a typical service, mostly small ints with some floats and strings
+def makeStates():
+    states = {}
+    for i in range(nResources):
+        if i % 4 == 0:
+            states["livingRoomTemperature%d" % i] = 20.0 + i / 100
+        elif i % 10 == 1:
+            states["frontDoorStatus%d" % i] = "closed"
+        else:
+            states["gardenSprinklerValve%d" % i] = i % 2
+    return states
+
+# return the time in microseconds to encode and decode the states and the size of the encoded states
+def timeEncoding(encode, decode):
+    data = encode()
+    startTime = time.perf_counter()
+    for loop in range(nLoops):
+        data = encode()
+    encodeTime = time.perf_counter() - startTime
+    startTime = time.perf_counter()
+    for loop in range(nLoops):
+        decode(data)
+    decodeTime = time.perf_counter() - startTime
+    return {"encodeUs": encodeTime * 1e6 / nLoops,
+            "decodeUs": decodeTime * 1e6 / nLoops,
+            "bytes": len(data)}
+
+def run():
+    states = makeStates()
+    names = list(states.keys())
+    index = {name: names.index(name) for name in names}
+    results = {"json": timeEncoding(lambda: json.dumps(states).encode("utf-8"),
+                                    lambda data: json.loads(data.decode("utf-8"), object_pairs_hook=numericKeys2Int)),
+               "packed": timeEncoding(lambda: packStates(states, index, 0),
+                                      lambda data: unpackStates(data, names))}
+    results["namesBytes"] = len(json.dumps({"timestamp": 0, "names": names}))
+    return results
+
+if __name__ == "__main__":
+    print(json.dumps({"benchmark": "stateEncoding", "resources": nResources, "results": run()}, indent=4))
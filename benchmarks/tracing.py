@@ -0,0 +1,42 @@
+# Measure the cost of debug instrumentation in a poll loop when the debug flag is off
+
+import sys
+import os
+import time
+import json
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from homealone import *
+
+nResources = 1000
+nLoops = 100
+
+class ByteInterface(Interface):
+    def read(self, addr):
+        return addr & 0xff
+
+# a poll loop over the sensors with the specified instrumentation of each read
+def pollLoop(sensors, instrumentation):
+    startTime = time.perf_counter()
+    for loop in range(nLoops):
+        for sensor in sensors:
+            byte = sensor.interface.read(sensor.addr)
+            if instrumentation == "debug":
+                debug("debugBenchmark", sensor.name, "read", "addr: 0x%02x" % sensor.addr, "value: 0x%02x" % byte)
+            elif instrumentation == "traceLazy":
+                trace("debugBenchmark", sensor.name, "read", lambda: "addr: 0x%02x" % sensor.addr, lambda: "value: 0x%02x" % byte)
+            elif instrumentation == "traceFlag":
+                if traceFlags.debugBenchmark:
+                    trace("debugBenchmark", sensor.name, "read", "addr: 0x%02x" % sensor.addr, "value: 0x%02x" % byte)
+    return (time.perf_counter() - startTime) * 1e9 / (nLoops * nResources)
+
+def run():
+    interface = ByteInterface("bytes")
+    sensors = [Sensor("sensor%d" % i, interface, i) for i in range(nResources)]
+    results = {instrumentation: {"nsPerRead": pollLoop(sensors, instrumentation)}
+               for instrumentation in ["none", "debug", "traceLazy", "traceFlag"]}
+    for instrumentation in results:
+        results[instrumentation]["nsOverhead"] = results[instrumentation]["nsPerRead"] - results["none"]["nsPerRead"]
+    return results
+
+if __name__ == "__main__":
+    print(json.dumps({"benchmark": "tracing", "resources": nResources, "results": run()}, indent=4))
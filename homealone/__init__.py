@@ -1,4 +1,6 @@
 from .env import *
+from .tracing import *
+from .lockProfiler import *
 from .utils import *
 from .core import *
 from .app import *
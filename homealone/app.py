@@ -15,27 +15,38 @@ class Application(object):
                     resourceChanged=None,
                  logger=True,                                               # data logger
                  system=False,                                              # system resources
-                 state=False, shared=False, changeMonitor=True):            # persistent state parameters
+                 state=False, shared=False, changeMonitor=True,             # persistent state parameters
+                 warmStart=False,                                           # start with the last known states
+                 sharedStates=False,                                        # share states in memory with apps on this host
+                 deltaAdverts=False,                                        # only advertise the states that changed
+                 packedAdverts=False):                                      # advertise the states in the packed encoding
         self.name = name
         self.globals = globals                                              # application global variables
-        self.event = threading.Event()                                      # state change event
+        self.event = ResourceEvent()                                        # state change event
         self.resources = Collection("resources")                            # application resources
         self.faults = faults                                                # advertise fault conditions
         self.separateRemote = separateRemote
         self.globals["resources"] = self.resources
-        self.states = StateCache("states", self.resources, self.event)      # resource state cache
+        if warmStart:
+            os.makedirs(stateDir, exist_ok=True)
+            checkpoint = stateDir+self.name+".states"
+        else:
+            checkpoint = None
+        self.states = StateCache("states", self.resources, self.event, checkpoint=checkpoint)  # resource state cache
         self.globals["states"] = self.states
         self.scheduler = Scheduler("scheduler")                             # schedule manager
         self.startList = []                                                 # resources that need to be started
         # publish resources via remote service
         if publish:
-            self.remoteService = RemoteService(self.name, self.resources, states=self.states, label=labelize(self.name), advert=advert)
+            self.remoteService = RemoteService(self.name, self.resources, states=self.states, label=labelize(self.name), advert=advert,
+                                               sharedStates=sharedStates, deltaAdverts=deltaAdverts,
+                                               packedAdverts=packedAdverts)
         else:
             self.remoteService = None
         # remote resource proxy
         if remote:
             if separateRemote:     # separate collection for remote resources
-                self.remoteEvent = threading.Event()
+                self.remoteEvent = ResourceEvent()
                 self.remoteResources = Collection("remoteResources")
                 self.globals["remoteResources"] = self.remoteResources
                 self.remoteStates = StateCache("remoteStates", self.remoteResources, self.remoteEvent)      # resource state cache
@@ -44,7 +55,7 @@ class Application(object):
                 self.remoteResources = self.resources
                 self.remoteEvent = self.event
             self.remoteClient = RemoteClient("remoteClient", self.remoteResources, watch=watch, ignore=ignore,
-                    resourceChanged=resourceChanged, event=self.remoteEvent)
+                    resourceChanged=resourceChanged, event=self.remoteEvent, sharedStates=sharedStates)
         else:
             self.remoteClient = None
             self.remoteResources = None
@@ -132,28 +143,36 @@ class Application(object):
     # apply a UI type to one or more resources
     def type(self, type, resources=[]):
         if resources == []:     # default is all resources
-            resources = list(self.resources.values())
+            resources = list(self.resources.members())
         for resource in listize(resources):
             resource.type = type
+            self.indexRes(resource)
 
     # associate one or more resources with one or more UI groups
     def group(self, group, resources=[]):
         if resources == []:     # default is all resources
-            resources = list(self.resources.values())
+            resources = list(self.resources.members())
         for resource in listize(resources):
             if resource.group == [""]:    # don't override if already set
                 resource.group = group
+                self.indexRes(resource)
+
+    # update the indexes of the collections that contain a resource after its attributes were changed
+    def indexRes(self, resource):
+        for collection in list(resource.collections.values()):
+            collection.indexRes(resource)
 
     # add a UI label to one or more resources
     def label(self, label=None, resources=[]):
         if resources == []:     # default is all resources
-            resources = list(self.resources.values())
+            resources = list(self.resources.members())
         for resource in listize(resources):
             if not resource.label:      # don't override if already set
                 if label:
                     resource.label = label
                 else:               # create a label from the name
                     resource.label = labelize(resource.name)
+                self.indexRes(resource)
 
     # callback to send notifications for faults
     def fault(self, id, fault=None, logFault=True):
@@ -3,8 +3,11 @@
 import time
 import threading
 import copy
+import json
 from collections import OrderedDict
 from rutifu import *
+from .tracing import *
+from .lockProfiler import *
 from .utils import *
 
 # names for sensor states
@@ -19,8 +22,38 @@ def normalState(value):
     elif value == False: return Off
     else: return value
 
+# A state change event that remembers which resources caused it to be set
+class ResourceEvent(threading.Event):
+    def __init__(self):
+        threading.Event.__init__(self)
+        self.sourceLock = threading.Lock()
+        self.sources = {}       # resources that have notified since the sources were last taken, by id
+        self.unknown = False    # the event was set without identifying the resource
+
+    # set the event and record the resource that changed
+    def set(self, source=None):
+        with self.sourceLock:
+            if source is None:
+                self.unknown = True
+            else:
+                self.sources[id(source)] = source
+        threading.Event.set(self)
+
+    # return the list of resources that changed and whether the event was set by an unknown source
+    # and start collecting a new set
+    def takeSources(self):
+        with self.sourceLock:
+            (sources, unknown) = (list(self.sources.values()), self.unknown)
+            self.sources = {}
+            self.unknown = False
+        return (sources, unknown)
+
 # Abstract base class for everything
+# The base classes don't define any slots of their own so that subclasses can combine them with other types
+# Subclasses that don't define __slots__ have a __dict__ for their attributes
 class Object(object):
+    __slots__ = ()
+
     def __init__(self):
         self.className = self.__class__.__name__    # Used to optionally override the real class name in dump()
 
@@ -31,6 +64,9 @@ class Object(object):
 
 # Abstract base class for Resources
 class Resource(Object):
+    __slots__ = ()
+    cacheDump = True        # False if the serialized object includes values that change without indexRes() being called
+
     def __init__(self, name, event):
         Object.__init__(self)
         try:
@@ -56,7 +92,10 @@ class Resource(Object):
     # trigger the sending of a state change notification
     def notify(self, state=None):
         if self.event:
-            self.event.set()
+            if isinstance(self.event, ResourceEvent):
+                self.event.set(self)    # identify this resource as the source of the change
+            else:
+                self.event.set()
 
     # add this resource to the specified collection
     def addCollection(self, collection):
@@ -83,7 +122,7 @@ class Interface(Resource):
         self.sensors = {}       # sensors using this instance of the interface by name
         self.sensorAddrs = {}   # sensors using this instance of the interface by addr
         self.states = {}        # sensor state cache
-        self.lock = threading.Lock()
+        self.lock = newLock(self.name)
 
     def start(self, notify=None):
         return True
@@ -94,6 +133,11 @@ class Interface(Resource):
     def read(self, addr):
         return None
 
+    # read a list of addresses and return a list of values in the same order
+    # interfaces that can read multiple addresses more efficiently than one at a time should override this
+    def readMany(self, addrs):
+        return [self.read(addr) for addr in addrs]
+
     def write(self, addr, value):
         return True
 
@@ -113,10 +157,30 @@ class Collection(Resource, OrderedDict):
     def __init__(self, name, resources=[]):
         Resource.__init__(self, name, None)
         OrderedDict.__init__(self)
-        self.lock = threading.Lock()
+        self.lock = newLock(self.name)
+        self.watchers = []      # functions to call when resources are added or deleted
+        # indexes of the resources by attribute value
+        # each entry is a list of resources in the order they were added
+        # resources are only appended to a list in place, otherwise the list is replaced,
+        # so a copy of it can be made without the lock
+        self.indexes = {"group": {}, "type": {}, "location": {}}
+        self.indexKeys = {}     # the resource and its index keys by name
+        self.positions = {}     # the order in which each resource was added by name
+        self.position = 0
+        self.version = 0        # incremented when resources are added, deleted, or changed
+        self.fragments = {}     # (resource, collection version, serialized JSON) of each resource by name
+        self.fragmentVersions = {}  # fragments of a resource built before this collection version are stale
+        self.documents = {}     # (version, serialized JSON) of the collection with and without expansion
+        self.dynamic = set()    # names of the resources whose serializations can't be cached
+        self.snapshot = ()      # immutable tuple of the resources, None after the membership changes until it is rebuilt
         for resource in resources:
             self.addRes(resource)
 
+    # register a function to call when resources are added to or deleted from this collection
+    # the function is called with the resource and True if it was added or False if it was deleted
+    def addWatcher(self, watcher):
+        self.watchers.append(watcher)
+
     # Add a list of resources to this collection
     def addRes(self, resources, state=None):
         if not isinstance(resources, list):
@@ -126,8 +190,19 @@ class Collection(Resource, OrderedDict):
                 try:
                     self.__setitem__(str(resource), resource)
                     resource.addCollection(self)
+                    if resource.name not in self.positions:
+                        self.positions[resource.name] = self.position
+                        self.position += 1
+                    self.updateIndexes(resource)
+                    self.dropFragment(resource.name)
+                    self.snapshot = None
+                    self.changed()
                 except Exception as ex:
                     logException(self.name+" addRes", ex)
+                    continue
+            if (not resource.cacheDump) or (resource.name in self.dynamic):
+                self.setDynamic(resource.name, not resource.cacheDump)
+            self.notifyWatchers(resource, True)
 
     # Delete a list of resources from this collection
     def delRes(self, names):
@@ -136,10 +211,104 @@ class Collection(Resource, OrderedDict):
         for name in names:
             with self.lock:
                 try:
-                    self.__getitem__(name).delCollection(self)
+                    resource = self.__getitem__(name)
+                    resource.delCollection(self)
                     self.__delitem__(name)
+                    self.updateIndexes(resource, False)
+                    del self.positions[name]
+                    self.dropFragment(name)
+                    self.snapshot = None
+                    self.changed()
                 except Exception as ex:
                     logException(self.name+" delRes", ex)
+                    continue
+            if name in self.dynamic:
+                self.setDynamic(name, False)
+            self.notifyWatchers(resource, False)
+
+    # record whether the serialization of a resource in the collection can be cached and pass it on
+    # to the collections that contain this one if that changes whether this one can be cached
+    def setDynamic(self, name, dynamic):
+        with self.lock:
+            wasDynamic = bool(self.dynamic)
+            if dynamic:
+                self.dynamic.add(name)
+            else:
+                self.dynamic.discard(name)
+            isDynamic = bool(self.dynamic)
+        if isDynamic != wasDynamic:
+            for collection in list(self.collections.values()):
+                collection.setDynamic(self.name, isDynamic)
+
+    # the expanded serialization can't be cached if it contains resources that can't be cached
+    @property
+    def cacheDump(self):
+        return not self.dynamic
+
+    # call the watchers outside of the lock so they can't block other users of the collection
+    def notifyWatchers(self, resource, added):
+        for watcher in self.watchers:
+            try:
+                watcher(resource, added)
+            except Exception as ex:
+                logException(self.name+" watcher", ex)
+
+    # Update the indexes and the cached serialization after attributes of a resource in the collection were changed
+    def indexRes(self, resource):
+        with self.lock:
+            if self.get(resource.name) is resource:
+                self.updateIndexes(resource)
+                self.dropFragment(resource.name)
+                self.changed()
+
+    # return the index keys for the attributes of a resource
+    def resourceKeys(self, resource):
+        try:
+            groups = listize(resource.group)
+        except AttributeError:      # not a sensor
+            return {}
+        location = getattr(resource, "location", None)
+        return {"group": set(groups),
+                "type": {getattr(resource, "type", None)},
+                "location": {tuple(location) if isinstance(location, list) else location}}
+
+    # add or remove a resource from the indexes, must be called with the lock held
+    def updateIndexes(self, resource, add=True):
+        (oldResource, oldKeys) = self.indexKeys.pop(resource.name, (None, {}))
+        newKeys = self.resourceKeys(resource) if add else {}
+        for (attr, index) in self.indexes.items():
+            old = oldKeys.get(attr, set())
+            new = newKeys.get(attr, set())
+            for key in old:
+                if key not in new:
+                    members = [member for member in index[key] if member.name != resource.name]
+                    if members:
+                        index[key] = members
+                    else:
+                        del index[key]
+                elif oldResource is not resource:   # a resource with the same name replaced it
+                    index[key] = [resource if member.name == resource.name else member for member in index[key]]
+            for key in new - old:
+                members = index.get(key)
+                if not members:
+                    index[key] = [resource]
+                elif self.positions[members[-1].name] < self.positions[resource.name]:
+                    members.append(resource)
+                else:   # the resource was added to the collection before the last one in the list
+                    index[key] = sorted(members + [resource], key=lambda member: self.positions[member.name])
+        if newKeys:
+            self.indexKeys[resource.name] = (resource, newKeys)
+
+    # Return a tuple of the resources in the collection
+    # it isn't affected by later changes to the collection so it can be iterated without the lock
+    def members(self):
+        snapshot = self.snapshot
+        if snapshot is None:        # rebuild it after the membership changed
+            with self.lock:
+                if self.snapshot is None:
+                    self.snapshot = tuple(self.values())
+                snapshot = self.snapshot
+        return snapshot
 
     # Get a resource from the collection
     # Return dummy sensor if not found
@@ -162,28 +331,100 @@ class Collection(Resource, OrderedDict):
     # Return a list of resource references that are members of the specified group
     # in order of addition to the table or sorted
     def getGroup(self, group, sort=False):
-        resourceList = []
-        resourceNames = list(self.keys())
+        return self.getIndex("group", group, sort)
+
+    # Return a list of resource references that have the specified type
+    def getType(self, type, sort=False):
+        return self.getIndex("type", type, sort)
+
+    # Return a list of resource references that have the specified location
+    def getLocation(self, location, sort=False):
+        return self.getIndex("location", tuple(location) if isinstance(location, list) else location, sort)
+
+    def getIndex(self, attr, key, sort):
+        resourceList = list(self.indexes[attr].get(key, ()))
         if sort:
-            resourceNames.sort()
-        for resourceName in resourceNames:
-            resource = self.__getitem__(resourceName)
-            if group in listize(resource.group):
-                resourceList.append(resource)
+            resourceList.sort(key=lambda resource: resource.name)
         return resourceList
 
     # attributes to include in the serialized object
     def dict(self, expand=False):
         return {"name":self.name,
-                "resources":([attr.dump(expand) for attr in list(self.values())] if expand else list(self.keys()))}
+                "resources":([attr.dump(expand) for attr in self.members()] if expand else
+                             [resource.name for resource in self.members()])}
+
+    # invalidate the cached serializations of this collection and the collections that contain it
+    def changed(self):
+        self.version += 1
+        for collection in list(self.collections.values()):
+            collection.changed()
+
+    # return the serialized JSON of the collection
+    # this is the same as json.dumps(self.dump(expand)) but it is reused until the collection changes and
+    # the expanded document is assembled from the cached serializations of the resources
+    # the expanded document is built every time if it contains resources that can't be cached
+    def dumpJson(self, expand=False):
+        version = self.version
+        cache = (not expand) or (not self.dynamic)
+        try:
+            (documentVersion, document) = self.documents[expand]
+            if cache and (documentVersion == version):
+                return document
+        except KeyError:
+            pass
+        if expand:
+            resourcesJson = "["+", ".join(self.resourceJson(resource) for resource in self.members())+"]"
+        else:
+            resourcesJson = json.dumps([resource.name for resource in self.members()])
+        document = '{"class": %s, "args": {"name": %s, "resources": %s}}' % \
+                        (json.dumps(self.className), json.dumps(self.name), resourcesJson)
+        if cache:
+            self.documents[expand] = (version, document)
+        return document
+
+    # return the cached serialized JSON of a resource in the collection
+    def resourceJson(self, resource):
+        if isinstance(resource, Collection):    # cached by the collection itself
+            return resource.dumpJson(True)
+        if not resource.cacheDump:
+            return json.dumps(resource.dump(True))
+        version = self.version
+        try:
+            (fragmentResource, fragmentVersion, fragment) = self.fragments[resource.name]
+            if (fragmentResource is resource) and (fragmentVersion >= self.fragmentVersions.get(resource.name, 0)):
+                return fragment
+        except KeyError:
+            pass
+        fragment = json.dumps(resource.dump(True))
+        # don't keep it if the resource was changed or replaced while it was being serialized
+        with self.lock:
+            if (self.get(resource.name) is resource) and (version >= self.fragmentVersions.get(resource.name, 0)):
+                self.fragments[resource.name] = (resource, version, fragment)
+        return fragment
+
+    # discard the cached serialization of a resource, must be called with the lock held before changed()
+    # a serialization that is being built concurrently is older than the next version so it won't be stored
+    def dropFragment(self, name):
+        self.fragments.pop(name, None)
+        self.fragmentVersions[name] = self.version + 1
+
+readLockLock = threading.Lock()     # serializes the creation of the read locks of sensors
 
 # A Sensor represents a device that has a state that is represented by a scalar value.
 # The state is associated with a unique address on an interface.
 # Sensors can also optionally be associated with a group and a physical location.
 class Sensor(Resource):
+    __slots__ = ("className", "name", "event", "enabled", "collections",
+                 "interface", "addr", "type", "resolution", "factor", "offset", "states",
+                 "poll", "minPoll", "maxPoll", "persistence", "interrupt",
+                 "deadband", "relDeadband", "minInterval", "heartbeat",
+                 "maxAge", "readLock", "readValue", "readTime",
+                 "location", "group", "label")
+
     def __init__(self, name, interface=None, addr=None, type="sensor", event=None,
                  factor=1, offset=0, resolution=0, states=None,
-                 poll=10, persistence=None, interrupt=None,
+                 poll=10, minPoll=None, maxPoll=None, persistence=None, interrupt=None,
+                 deadband=None, relDeadband=None, minInterval=None, heartbeat=None, maxAge=None,
                  label="", group="", location=None):
         Resource.__init__(self, name, event)
         self.interface = interface
@@ -198,43 +439,76 @@ class Sensor(Resource):
         self.offset = offset
         self.states = states
         self.poll = poll
+        self.minPoll = minPoll              # shortest polling interval when the state is changing
+        self.maxPoll = maxPoll              # longest polling interval when the state isn't changing
         self.persistence = persistence
         self.interrupt = interrupt
+        self.deadband = deadband            # ignore changes less than this absolute amount
+        self.relDeadband = relDeadband      # ignore changes less than this fraction of the last value
+        self.minInterval = minInterval      # minimum number of seconds between reported changes
+        self.heartbeat = heartbeat          # report the state at least this often in seconds even if it didn't change
+        self.maxAge = maxAge                # reuse a value read from the interface for this many seconds
+        self.readLock = None                # serializes reads of the interface, created when maxAge is first used
+        self.readValue = None               # the last value read from the interface
+        self.readTime = None                # when the last value was read
         self.location = location
         self.group = listize(group)
         self.label = label
-        self.__dict__["state"] = None   # dummy class variable so hasattr() returns True
-        # FIXME - use @property
 
     # Return the state of the sensor by reading the value from the address on the interface.
     def getState(self, missing=None):
         if self.enabled:
-            state = (normalState(self.interface.read(self.addr)) if self.interface else None)
-            try:
-                return round(state * self.factor + self.offset, self.resolution)
-            except TypeError:
-                return state
+            if self.maxAge:
+                return self.convertState(self.readCached())
+            return self.convertState(self.interface.read(self.addr) if self.interface else None)
         else:
             return None
 
+    # Return the value from the interface if it was read within maxAge seconds, otherwise read it.
+    # Callers that arrive while a read is in progress wait for it and use its value.
+    def readCached(self):
+        if self.isFresh():
+            return self.readValue
+        with self.getReadLock():
+            if self.isFresh():
+                return self.readValue   # read by another caller while this one was waiting
+            self.cacheValue(self.interface.read(self.addr) if self.interface else None)
+            return self.readValue
+
+    # Return the lock that serializes reads of the interface, creating it the first time
+    # only sensors with maxAge need it so the others don't carry one
+    def getReadLock(self):
+        if self.readLock is None:
+            with readLockLock:
+                if self.readLock is None:
+                    self.readLock = threading.Lock()
+        return self.readLock
+
+    # Return True if the value that was last read from the interface can be reused.
+    def isFresh(self):
+        return (self.maxAge is not None) and (self.readTime is not None) and (time.monotonic() - self.readTime < self.maxAge)
+
+    # Save a value that was read from the interface for callers within maxAge seconds.
+    def cacheValue(self, value):
+        self.readValue = value
+        self.readTime = time.monotonic()
+
+    # Convert a value that was read from the interface to the state of the sensor.
+    def convertState(self, value):
+        state = normalState(value)
+        try:
+            return round(state * self.factor + self.offset, self.resolution)
+        except TypeError:
+            return state
+
     # Define this function for sensors even though it does nothing
     def setState(self, state, wait=False):
-        debug('debugState', "Sensor", self.name, "setState ", state)
+        if traceFlags.debugState:
+            trace('debugState', "Sensor", self.name, "setState ", state)
         return False
 
-    # override to handle special cases of state
-    def __getattribute__(self, attr):
-        if attr == "state":
-            return self.getState()
-        else:
-            return Resource.__getattribute__(self, attr)
-
-    # override to handle special case of state
-    def __setattr__(self, attr, value):
-        if attr == "state":
-            self.setState(value)
-        else:
-            Resource.__setattr__(self, attr, value)
+    # the state attribute reads and writes the sensor through the getState() and setState() of the subclass
+    state = property(lambda self: self.getState(), lambda self, state: self.setState(state))
 
     # attributes to include in the serialized object
     def dict(self, expand=False):
@@ -245,6 +519,13 @@ class Sensor(Resource):
                 "resolution": self.resolution,
                 **({"states": self.states} if self.states else {}),
                 "poll": self.poll,
+                **({"minPoll": self.minPoll} if self.minPoll else {}),
+                **({"maxPoll": self.maxPoll} if self.maxPoll else {}),
+                **({"deadband": self.deadband} if self.deadband else {}),
+                **({"relDeadband": self.relDeadband} if self.relDeadband else {}),
+                **({"minInterval": self.minInterval} if self.minInterval else {}),
+                **({"heartbeat": self.heartbeat} if self.heartbeat else {}),
+                **({"maxAge": self.maxAge} if self.maxAge else {}),
                 "persistence": str(self.persistence),
                 **({"location": self.location} if self.location else {}),
                 "group":self.group,
@@ -252,6 +533,8 @@ class Sensor(Resource):
 
 # A Control is a Sensor whose state can be set
 class Control(Sensor):
+    __slots__ = ("setStates", "stateSet")
+
     def __init__(self, name, interface=None, addr=None, states=None, setStates=None,
                  type="control", stateSet=None, **kwargs):
         # if states is None:     # default is enum type
@@ -262,7 +545,8 @@ class Control(Sensor):
 
     # Set the state of the control by writing the value to the address on the interface.
     def setState(self, state, wait=False, notify=True):
-        debug('debugState', "setState", self.name, "state:", state, "notify:", notify)
+        if traceFlags.debugState:
+            trace('debugState', "setState", self.name, "state:", state, "notify:", notify)
         if self.enabled and self.interface:
             self.interface.write(self.addr, state)
             if notify:
@@ -274,7 +558,8 @@ class Control(Sensor):
             return False
 
     def notify(self, state=None):
-        debug('debugState', "notify", self.name, "state:", state)
+        if traceFlags.debugState:
+            trace('debugState', "notify", self.name, "state:", state)
         Resource.notify(self, state)
         if self.stateSet:
             self.stateSet(self, state)
@@ -45,6 +45,19 @@ logChanged = True
 archiveService = "archive"
 archiveDir = "/archives/"
 
+# debug flags that are always off so the tracing they guard never runs
+disabledTraceFlags = []
+
+# record wait and hold times of interface, collection and state locks for lockReport()
+profileLocks = False
+
+# state cache parameters
+pollWorkers = 0                 # number of threads that poll interfaces in parallel, 0 polls serially
+stateChangeLogSize = 1000       # number of recent state changes kept for StateCache.getChanges()
+pollBackoff = 1.5               # factor that an adaptive polling interval is stretched by when the state doesn't change
+stateCheckpointInterval = 60    # how often in seconds to save the states for a warm start
+readStatsBuckets = (.001, .002, .005, .01, .02, .05, .1, .2, .5, 1, 2, 5, 10)    # read time histogram buckets in seconds
+
 # remote interface parameters
 remoteAdvertPort = 7370
 restServicePortPool = [7378, 7377, 7376, 7375, 7374, 7373, 7372, 7371]
@@ -53,8 +66,20 @@ ipv6MulticastAddr = "ff02::1"
 multicastAddr = ipv4MulticastAddr
 remoteAdvertInterval = 10
 remoteAdvertTimeout = 60
+remoteAdvertMaxSize = 1400          # maximum size in bytes of an advert datagram, larger adverts are sent in fragments
+remoteAdvertMaxFragments = 32       # adverts that need more fragments tell clients to read the data via REST
+remoteAdvertFragmentMessages = 16   # maximum number of adverts that a client reassembles at the same time
+remoteAdvertFragmentTimeout = 5     # seconds after which an incomplete advert is discarded
 restTimeout = 60
 restRetryInterval = 10
+restPoolSize = 4                # maximum number of keep-alive connections to each remote service
+restIdleTimeout = 30            # seconds after which unused connections to a remote service are closed
+restValidators = 16             # number of REST responses for each remote service that are kept to be validated with an ETag
+sharedStateSlots = 1024         # number of resources in a shared memory state segment
+sharedStateSlotSize = 64        # maximum size in bytes of an encoded state in shared memory
+sharedStateIndexSize = 65536    # maximum size in bytes of the resource index in shared memory
+sharedStateReopenInterval = 1   # minimum number of seconds between attempts to open a closed shared state segment
+sharedStateReadRetries = 100    # number of times a shared state is read while it is being changed before giving up
 
 # Alerts and events
 alertConfig = {}
@@ -15,20 +15,36 @@ from homealone import *
 class ADS1263Interface(Interface):
     def __init__(self, name, interface=None, event=None):
         Interface.__init__(self, name, interface, event)
-        self.lock = threading.Lock()
+        self.lock = newLock(self.name)
         self.adc = ADS1263()
 
     def read(self, addr):
-        debug('debugAdc', self.name, "read", addr)
+        if traceFlags.debugAdc:
+            trace('debugAdc', self.name, "read", addr)
         try:
             with self.lock:
                 value = self.adc.ADS1263_GetChannelValue(addr)
-                debug('debugAdc', self.name, "value", value)
+                if traceFlags.debugAdc:
+                    trace('debugAdc', self.name, "value", value)
             return float(value * REF / 0x7fffffff) # 2147483647
         except Exception as ex:
             log("ADS1263Interface exception", type(ex).__name__, str(ex))
             return 0
 
+    # read all the channels while holding the lock once
+    def readMany(self, addrs):
+        if traceFlags.debugAdc:
+            trace('debugAdc', self.name, "readMany", addrs)
+        try:
+            with self.lock:
+                values = self.adc.ADS1263_GetAll(addrs)
+                if traceFlags.debugAdc:
+                    trace('debugAdc', self.name, "values", values)
+            return [float(value * REF / 0x7fffffff) for value in values]
+        except Exception as ex:
+            log("ADS1263Interface exception", type(ex).__name__, str(ex))
+            return [0 for addr in addrs]
+
 # /*****************************************************************************
 # * | File        :   ADS1263.py
 # * | Author      :   Waveshare team
@@ -16,16 +16,18 @@ class ADS1x15Interface(Interface):
         self.sps = sps
         self.icType = icType
         self.adc = ADS1x15(i2c=self.interface, addr=addr, icType=self.icType)
-        self.lock = threading.Lock()
+        self.lock = newLock(self.name)
         self.event = event
 
     def read(self, addr):
-        debug('debugAds', self.name, "read", addr, "gain", self.gain)
+        if traceFlags.debugAds:
+            trace('debugAds', self.name, "read", addr, "gain", self.gain)
         try:
             with self.lock:
                 # time.sleep(sampleRate)
                 value = self.adc.readADCSingleEnded(addr, self.gain, self.sps)
-                debug('debugAds', self.name, "value", value)
+                if traceFlags.debugAds:
+                    trace('debugAds', self.name, "value", value)
             return float(value / 1000)
         except Exception as ex:
             log("ADS1x15Interface exception", type(ex).__name__, str(ex))
@@ -36,12 +38,14 @@ class ADS1x15DiffInterface(ADS1x15Interface):
         ADS1x15Interface.__init__(self, name, interface, addr, gain, sps, icType)
 
     def read(self, addr):
-        debug('debugAds', self.name, "read", addr, "gain", self.gain)
+        if traceFlags.debugAds:
+            trace('debugAds', self.name, "read", addr, "gain", self.gain)
         try:
             with self.lock:
                 # time.sleep(sampleRate)
                 value = self.adc.readADCDifferential(addr, addr+1, self.gain, self.sps)
-                debug('debugAds', self.name, "value", value)
+                if traceFlags.debugAds:
+                    trace('debugAds', self.name, "value", value)
             return float(value / 1000)
         except Exception as ex:
             log("ADS1x15DiffInterface exception", type(ex).__name__, str(ex))
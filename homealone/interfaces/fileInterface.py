@@ -20,7 +20,7 @@ class FileInterface(Interface):
         self.initialState = initialState    # values to set if the file doesn't exist
         self.data = {}                      # cached data
         self.mtime = 0                      # last time the file was modified
-        self.lock = threading.Lock()
+        self.lock = newLock(self.name)
         if start:                           # immediately start the interface
             self.start()
 
@@ -65,6 +65,15 @@ class FileInterface(Interface):
         debug('debugFileData', self.name, "read", "addr", addr, "value", value)
         return value
 
+    # read the file at most once for all the addresses
+    def readMany(self, addrs):
+        if not self.changeMonitor:   # read the file every time
+            self.readData()
+        with self.lock:
+            values = [self.data.get(addr, self.defaultValue) for addr in addrs]
+        debug('debugFileData', self.name, "readMany", "addrs", addrs, "values", values)
+        return values
+
     def write(self, addr, value):
         if not self.readOnly:
             debug('debugFileData', self.name, "write", "addr", addr, "value", value)
@@ -110,18 +110,21 @@ class MCP23017Interface(Interface):
             self.interruptEvent.clear()
             # intFlags = self.interface.read((self.addr, MCP23017Interface.INTF+self.bank))
             self.state = self.interface.read((self.addr, MCP23017Interface.INTCAP+self.bank))
-            debug('debugGPIO', self.name, "read ", "addr: 0x%02x"%self.addr, "reg: 0x%02x"%(MCP23017Interface.INTCAP+self.bank), "value: 0x%02x"%self.state)
+            if traceFlags.debugGPIO:
+                trace('debugGPIO', self.name, "read ", "addr: 0x%02x"%self.addr, "reg: 0x%02x"%(MCP23017Interface.INTCAP+self.bank), "value: 0x%02x"%self.state)
             # because INTF register isn't reliable, compare current state to previous for input pins
             intFlags = (self.state ^ self.lastState) & self.inOut
             self.lastState = self.state
-            debug('debugGPIO', self.name, "int  ", "addr: 0x%02x"%self.addr, "reg: 0x%02x"%(MCP23017Interface.INTF+self.bank), "intFlags: 0x%02x"%intFlags)
+            if traceFlags.debugGPIO:
+                trace('debugGPIO', self.name, "int  ", "addr: 0x%02x"%self.addr, "reg: 0x%02x"%(MCP23017Interface.INTF+self.bank), "intFlags: 0x%02x"%intFlags)
             for i in range(8):
                 if (intFlags >> i) & 0x01:
                     try:
                         sensor = self.sensorAddrs[i]
                         state = (self.state >> i) & 0x01
                         if sensor.event:    # don't notify polled sensors
-                            debug('debugGPIO', self.name, "notifying", sensor.name, state)
+                            if traceFlags.debugGPIO:
+                                trace('debugGPIO', self.name, "notifying", sensor.name, state)
                             sensor.notify(state)
                     except KeyError:
                         debug('debugGPIO', self.name, "no sensor for interrupt on addr", i, self.sensorAddrs)
@@ -133,9 +136,18 @@ class MCP23017Interface(Interface):
         else:
             return 0
 
+    # all the bits come from a single read of the GPIO register
+    def readMany(self, addrs):
+        if self.interface:
+            self.readState()
+            return [(self.state >> addr) & 0x01 for addr in addrs]
+        else:
+            return [0 for addr in addrs]
+
     def readState(self):
         byte = self.interface.read((self.addr, MCP23017Interface.GPIO+self.bank))
-        debug('debugGPIORead', self.name, "read ", "addr: 0x%02x"%self.addr, "reg: 0x%02x"%(MCP23017Interface.GPIO+self.bank), "value: 0x%02x"%byte)
+        if traceFlags.debugGPIORead:
+            trace('debugGPIORead', self.name, "read ", "addr: 0x%02x"%self.addr, "reg: 0x%02x"%(MCP23017Interface.GPIO+self.bank), "value: 0x%02x"%byte)
         self.state = byte
 
     def write(self, addr, value):
@@ -143,9 +155,11 @@ class MCP23017Interface(Interface):
             byte = self.state
             mask = 0x01<<addr
             byte = (byte & (~mask)) | ((value << addr) & mask)
-            debug('debugGPIO', self.name, "write", "addr: 0x%02x"%self.addr, "reg: 0x%02x"%(MCP23017Interface.GPIO+self.bank), "value: 0x%02x"%byte)
+            if traceFlags.debugGPIO:
+                trace('debugGPIO', self.name, "write", "addr: 0x%02x"%self.addr, "reg: 0x%02x"%(MCP23017Interface.GPIO+self.bank), "value: 0x%02x"%byte)
             self.interface.write((self.addr, MCP23017Interface.GPIO+self.bank), byte)
             self.state = byte
         else:
-            debug('debugGPIO', self.name, "write", "addr: 0x%02x"%addr, "value: 0x%02x"%value)
+            if traceFlags.debugGPIO:
+                trace('debugGPIO', self.name, "write", "addr: 0x%02x"%addr, "value: 0x%02x"%value)
             gpio.output(MCP23017Interface.gpioPins[addr], value)
@@ -19,3 +19,21 @@ class OWFSInterface(Interface):
                     return 0
         except:
             return None
+
+    # start a simultaneous conversion of all the sensors on the bus and then read the results
+    # instead of waiting for a separate conversion for each sensor
+    def readMany(self, addrs):
+        debug('debugTemp', self.name, "readMany", addrs)
+        try:
+            with open(self.home+"simultaneous/temperature", "w") as owfs:
+                owfs.write("1")
+        except OSError:
+            return [self.read(addr) for addr in addrs]
+        values = []
+        for addr in addrs:
+            try:
+                with open(self.home+addr+"/latesttemp") as owfs:
+                    values.append(float(owfs.read()))
+            except (OSError, ValueError):
+                values.append(self.read(addr))
+        return values
@@ -0,0 +1,150 @@
+# Lock contention profiling
+
+# Locks that are created with newLock() are plain threading.Lock objects unless profileLocks is set
+# in the site configuration, in which case they are ProfiledLock objects that record how long threads
+# wait for them and hold them, by call site.  lockReport() summarizes the worst locks and threads and
+# shows which threads are currently holding or waiting for each lock.
+
+import sys
+import os
+import time
+import threading
+import weakref
+from .env import *
+
+profiledLocks = weakref.WeakSet()      # all the ProfiledLocks that exist
+
+# return a lock, profiled if profiling is enabled
+def newLock(name):
+    if profileLocks:
+        return ProfiledLock(name)
+    else:
+        return threading.Lock()
+
+# return the file, line and function of the code that called into this module
+def callSite():
+    frame = sys._getframe(1)
+    while frame.f_code.co_filename == __file__:
+        frame = frame.f_back
+    return "%s:%d %s" % (os.path.basename(frame.f_code.co_filename), frame.f_lineno, frame.f_code.co_name)
+
+# A lock that records wait and hold times
+class ProfiledLock(object):
+    def __init__(self, name):
+        self.name = name
+        self.lock = threading.Lock()
+        self.statsLock = threading.Lock()
+        self.acquisitions = 0
+        self.contentions = 0        # number of times the lock was already held when it was acquired
+        self.waitTime = 0.0
+        self.maxWait = 0.0
+        self.holdTime = 0.0
+        self.maxHold = 0.0
+        self.sites = {}             # [acquisitions, wait time, hold time, max hold time] by call site
+        self.threads = {}           # wait time by thread name
+        self.holder = None          # (thread name, call site, time acquired) of the current holder
+        self.waiters = {}           # (thread name, call site, time started waiting) by thread id
+        profiledLocks.add(self)
+
+    def acquire(self, blocking=True, timeout=-1):
+        site = callSite()
+        thread = threading.current_thread()
+        waited = 0.0
+        if not self.lock.acquire(False):
+            if not blocking:
+                return False
+            startTime = time.monotonic()
+            self.waiters[thread.ident] = (thread.name, site, startTime)
+            try:
+                acquired = self.lock.acquire(True, timeout)
+            finally:
+                del self.waiters[thread.ident]
+            waited = time.monotonic() - startTime
+            with self.statsLock:
+                self.contentions += 1
+                self.waitTime += waited
+                self.maxWait = max(self.maxWait, waited)
+                self.threads[thread.name] = self.threads.get(thread.name, 0.0) + waited
+            if not acquired:
+                return False
+        self.holder = (thread.name, site, time.monotonic())
+        with self.statsLock:
+            self.acquisitions += 1
+            try:
+                self.sites[site][0] += 1
+                self.sites[site][1] += waited
+            except KeyError:
+                self.sites[site] = [1, waited, 0.0, 0.0]
+        return True
+
+    def release(self):
+        holder = self.holder
+        if holder is None:      # raises RuntimeError like threading.Lock if the lock isn't held
+            self.lock.release()
+            return
+        (threadName, site, acquireTime) = holder
+        held = time.monotonic() - acquireTime
+        self.holder = None
+        self.lock.release()
+        with self.statsLock:
+            self.holdTime += held
+            self.maxHold = max(self.maxHold, held)
+            self.sites[site][2] += held
+            self.sites[site][3] = max(self.sites[site][3], held)
+
+    def locked(self):
+        return self.lock.locked()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.release()
+
+    # return the statistics of the lock
+    def getStats(self):
+        now = time.monotonic()
+        holder = self.holder
+        with self.statsLock:
+            return {"name": self.name,
+                    "acquisitions": self.acquisitions,
+                    "contentions": self.contentions,
+                    "waitTime": self.waitTime,
+                    "maxWait": self.maxWait,
+                    "holdTime": self.holdTime,
+                    "maxHold": self.maxHold,
+                    "sites": {site: {"acquisitions": stats[0], "waitTime": stats[1], "holdTime": stats[2], "maxHold": stats[3]}
+                              for (site, stats) in self.sites.items()},
+                    "threads": dict(self.threads),
+                    "holder": {"thread": holder[0], "site": holder[1], "held": now - holder[2]} if holder else None,
+                    "waiters": [{"thread": waiter[0], "site": waiter[1], "waiting": now - waiter[2]}
+                                for waiter in list(self.waiters.values())]}
+
+# return the statistics of all the profiled locks
+def getLockStats():
+    return [lock.getStats() for lock in list(profiledLocks)]
+
+# return a printable report of the locks with the most wait time and the threads that waited the longest
+def lockReport(count=10, sites=3):
+    lockStats = sorted(getLockStats(), key=lambda stats: stats["waitTime"], reverse=True)
+    lines = ["%-32s %10s %10s %10s %10s %10s %10s" % ("lock", "acquired", "contended", "wait", "maxWait", "hold", "maxHold")]
+    threadWaits = {}
+    for stats in lockStats:
+        for (threadName, waitTime) in stats["threads"].items():
+            threadWaits[threadName] = threadWaits.get(threadName, 0.0) + waitTime
+    for stats in lockStats[:count]:
+        lines.append("%-32s %10d %10d %10.3f %10.3f %10.3f %10.3f" % (stats["name"], stats["acquisitions"], stats["contentions"],
+                     stats["waitTime"], stats["maxWait"], stats["holdTime"], stats["maxHold"]))
+        for (site, siteStats) in sorted(stats["sites"].items(), key=lambda item: item[1]["holdTime"], reverse=True)[:sites]:
+            lines.append("    held by %-40s %8d times %10.3f seconds max %.3f" % (site, siteStats["acquisitions"],
+                         siteStats["holdTime"], siteStats["maxHold"]))
+        if stats["holder"]:
+            lines.append("    now held by %s at %s for %.3f seconds" % (stats["holder"]["thread"], stats["holder"]["site"],
+                         stats["holder"]["held"]))
+        for waiter in stats["waiters"]:
+            lines.append("    now waited for by %s at %s for %.3f seconds" % (waiter["thread"], waiter["site"], waiter["waiting"]))
+    lines.append("threads with the most wait time:")
+    for (threadName, waitTime) in sorted(threadWaits.items(), key=lambda item: item[1], reverse=True)[:count]:
+        lines.append("    %-40s %10.3f" % (threadName, waitTime))
+    return "\n".join(lines)
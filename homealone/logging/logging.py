@@ -43,22 +43,22 @@ class DataLogger(object):
             debug("debugMetrics", "got IP address", metricsIp, "for", metricsHost)
             if self.notify:
                 self.notify("sendMetrics")  # reset the fault
+        subscription = self.states.subscribe(self.name)
+        states = {}
         while True:
-            # wait for a new set of states
-            states = self.states.getStates(wait=True)
+            # wait for the states that changed
+            (version, changedStates) = subscription.get(wait=True)
+            states.update(changedStates)
             today = time.strftime("%Y%m%d")
 
             # log states to a file
             if logData:
                 if today != lastDay:    # start with a new baseline every day
-                    lastStates = states
-                changedStates = diffStates(lastStates, states, deleted=False)
-                if changedStates != {}:
-                    logFileName = self.logDir+today+".json"
-                    debug("debugLogging", "writing states to", logFileName)
-                    with open(logFileName, "a") as logFile:
-                        logFile.write(json.dumps([time.time(), (changedStates if logChanged else lastStates)])+"\n")
-                lastStates = states
+                    changedStates = states
+                logFileName = self.logDir+today+".json"
+                debug("debugLogging", "writing states to", logFileName)
+                with open(logFileName, "a") as logFile:
+                    logFile.write(json.dumps([time.time(), (changedStates if logChanged else states)])+"\n")
 
             # send states to the metrics server
             if sendMetrics:
@@ -52,6 +52,12 @@ class ProxyService(Sensor):
         self.faults = {}
         self.messageTimer = None
         self.updating = False
+        self.resync = False             # the states must be reloaded because a delta advert was missed
+        self.reload = False             # the resources must be reloaded because they were too large to advertise
+        self.deltaAdverts = False       # the service sends delta adverts
+        self.stateVersion = 0           # state version of the service of the latest states that were applied
+        self.pendingChanges = None      # (version, changes) of delta adverts received while the states are being read
+        self.stateLock = threading.Lock()
         self.lastSeq = 0                # the last message sequence number received
         self.missedSeq = 0              # count of how many missed messages for this service
         self.missedSeqPct = 0.0         # percentage of missed messages
@@ -89,7 +95,7 @@ class ProxyService(Sensor):
 
     def enable(self):
         debug('debugProxyService', "ProxyService", self.name, "enabled")
-        for resource in list(self.resources.values()):
+        for resource in list(self.resources.members()):
             resource.enable()
         self.interface.start()
         self.enabled = True
@@ -103,22 +109,63 @@ class ProxyService(Sensor):
             self.messageTimer.cancel()
             debug('debugMessageTimer', self.name, "timer cancelled", "disabled", int(time.time()))
         self.messageTimer = None
-        for resource in list(self.resources.values()):
+        for resource in list(self.resources.members()):
             resource.disable()
         self.notify(False)
 
+    # apply the changes of a delta advert unless the states that were read from the service are newer
+    def applyChanges(self, version, changes):
+        with self.stateLock:
+            if self.pendingChanges is not None:
+                self.pendingChanges.append((version, changes))
+            if version > self.stateVersion:
+                self.interface.setStates(changes)
+                self.stateVersion = version
+
+    # apply the states of all resources at a version
+    # return False if changes that are newer than them have already been applied
+    def applyStates(self, version, states):
+        with self.stateLock:
+            if version < self.stateVersion:
+                return False
+            self.interface.setStates(states)
+            self.stateVersion = version
+            return True
+
+    # start keeping the changes of delta adverts until the states that are being read are applied
+    def startSnapshot(self):
+        with self.stateLock:
+            self.pendingChanges = []
+
+    # apply the states of all resources that were read from the service and then the changes that were
+    # received after their version
+    # the version replaces the previous one in case the service was restarted
+    def applySnapshot(self, version, states):
+        with self.stateLock:
+            self.interface.setStates(states)
+            self.stateVersion = version
+            for (changeVersion, changes) in (self.pendingChanges or []):
+                if changeVersion > self.stateVersion:
+                    self.interface.setStates(changes)
+                    self.stateVersion = changeVersion
+            self.pendingChanges = None
+
+    # count missed messages and return True if any messages were missed since the previous one
     def logSeq(self, seq):
         debug('debugRemoteSeq', "ProxyService", self.name, seq, self.lastSeq, self.missedSeq, self.missedSeqPct)
+        missed = False
         if seq == 0:
             self.lastSeq = 0    # reset when the service starts
             self.missedSeqPct = 0.0
         if self.lastSeq != 0:   # ignore the first one after this program starts
+            missed = seq != self.lastSeq + 1
             self.missedSeq += seq - self.lastSeq - 1
         if seq > 0:
             self.missedSeqPct = float(self.missedSeq) / float(seq)
         self.lastSeq = seq
         self.missedSeqSensor.notify()
         self.missedSeqPctSensor.notify()
+        return missed
 
     # define a timer to disable the service if the message timer times out
     # can't use a socket timeout because multiple threads are using the same port
@@ -1,17 +1,25 @@
 from homealone import *
 from homealone.remote.proxyService import *
 from homealone.remote.restInterface import *
+from homealone.remote.sharedStates import *
 import json
 import threading
 import socket
 import time
+import collections
+import base64
 
 # Client side for remote services
 
-def parseServiceData(data, addr):
+# parse an advert message
+# if fragments is specified, a fragment of a message is added to it and the resources and states of the message
+# are returned with the fragment that completes it
+def parseServiceData(data, addr, fragments=None):
     try:
         serviceData = json.loads(data.decode("utf-8"))
         debug('debugRemoteClientData', "data", serviceData)
+        if (fragments is not None) and ("fragment" in serviceData):
+            serviceData.update(fragments.add(addr, serviceData["service"]["name"], serviceData["fragment"]))
         try:
             serviceResources = serviceData["resources"]
         except KeyError:
@@ -19,7 +27,21 @@ def parseServiceData(data, addr):
         try:
             serviceStates = serviceData["states"]
         except KeyError:
-            serviceStates = None
+            try:        # packed states are returned as bytes
+                serviceStates = base64.b64decode(serviceData["packedstates"])
+            except KeyError:
+                serviceStates = None
+        try:
+            serviceChanges = serviceData["changes"]
+        except KeyError:
+            try:
+                serviceChanges = base64.b64decode(serviceData["packedchanges"])
+            except KeyError:
+                serviceChanges = None
+        try:
+            serviceFetch = serviceData["fetch"]     # items that were too large to advertise
+        except KeyError:
+            serviceFetch = []
         serviceData = serviceData["service"]
         serviceName = serviceData["name"]
         serviceAddr = addr[0]+":"+str(serviceData["port"])
@@ -33,19 +55,55 @@ def parseServiceData(data, addr):
             version = serviceData["version"]
         except KeyError:
             version = 0
+        try:
+            stateVersion = serviceData["stateversion"]
+        except KeyError:
+            stateVersion = 0
         try:
             serviceFaults = serviceData["faults"]
         except KeyError:
             serviceFaults = {}
+        try:
+            serviceEncodings = serviceData["encodings"]
+        except KeyError:
+            serviceEncodings = ["json"]
         serviceLabel = serviceData["label"]
         serviceSeq = serviceData["seq"]
-        return (serviceName, serviceAddr, serviceLabel, version, serviceSeq, stateTimeStamp, resourceTimeStamp, serviceFaults, serviceStates, serviceResources)
+        return (serviceName, serviceAddr, serviceLabel, version, serviceSeq, stateTimeStamp, resourceTimeStamp, stateVersion, serviceFaults, serviceStates, serviceResources, serviceChanges, serviceFetch, serviceEncodings)
     except Exception as ex:
         logException("parseServiceData", ex)
-        return ("", "", "", 0, 0, 0, 0, {}, {}, [])
+        return ("", "", "", 0, 0, 0, 0, 0, {}, {}, [], None, [], ["json"])
+
+# reassembly buffer for adverts that are sent in fragments
+class AdvertFragments(object):
+    def __init__(self, maxMessages=None, timeout=None):
+        self.maxMessages = maxMessages if maxMessages else remoteAdvertFragmentMessages
+        self.timeout = timeout if timeout else remoteAdvertFragmentTimeout
+        self.messages = collections.OrderedDict()   # [time, number of parts, data by part] by message
+
+    # add a fragment and return the contents of the message if it is complete, otherwise an empty dictionary
+    def add(self, addr, serviceName, fragment):
+        now = time.time()
+        for (key, message) in list(self.messages.items()):    # discard messages that will never be completed
+            if now - message[0] > self.timeout:
+                debug('debugRemoteFragment', "discarding incomplete advert", key, len(message[2]), message[1])
+                del self.messages[key]
+        key = (addr[0], serviceName, fragment["id"])
+        try:
+            message = self.messages[key]
+        except KeyError:
+            message = self.messages[key] = [now, int(fragment["parts"]), {}]
+            if len(self.messages) > self.maxMessages:
+                self.messages.popitem(last=False)
+        message[2][int(fragment["part"])] = fragment["data"]
+        if len(message[2]) < message[1]:
+            return {}
+        del self.messages[key]
+        return json.loads("".join(message[2][part] for part in range(message[1])))
 
 class RemoteClient(LogThread):
-    def __init__(self, name, resources, watch=[], ignore=[], event=None, cache=True, resourceChanged=None):
+    def __init__(self, name, resources, watch=[], ignore=[], event=None, cache=True, resourceChanged=None,
+                 sharedStates=False):
         debug('debugRemoteClient', name, "starting", name)
         LogThread.__init__(self, name=name, target=self.restProxyThread)
         self.name = name
@@ -55,7 +113,10 @@ class RemoteClient(LogThread):
         self.ignore = ignore                    # services to ignore
         self.event = event
         self.cache = cache
+        self.states = StateTable()              # state caches of the services
+        self.sharedStates = sharedStates        # read the states of services on this host from shared memory
         self.resourceChanged = resourceChanged  # callback when resources on a remote service change
+        self.fragments = AdvertFragments()      # adverts that are being reassembled
         debug('debugRemoteClient', name, "watching", self.watch)    # watch == [] means watch all services
         debug('debugRemoteClient', name, "ignoring", self.ignore)
         self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
@@ -66,13 +127,13 @@ class RemoteClient(LogThread):
         debug('debugThread', self.name, "started")
         while True:
             # wait for a notification message from a service
-            (data, addr) = self.socket.recvfrom(32768)  # FIXME - need to handle arbitrarily large data
+            (data, addr) = self.socket.recvfrom(65535)  # large adverts are sent in fragments
             if addr[0][0:7] == "169.254":               # ignore messages if the network isn't fully up
                 continue
             debug('debugRemoteMessage', self.name, "notification data", data)
             # parse the message
-            (serviceName, serviceAddr, serviceLabel, version, serviceSeq, stateTimeStamp, resourceTimeStamp, serviceFaults, serviceStates, serviceResources) = \
-                parseServiceData(data, addr)
+            (serviceName, serviceAddr, serviceLabel, version, serviceSeq, stateTimeStamp, resourceTimeStamp, stateVersion, serviceFaults, serviceStates, serviceResources, serviceChanges, serviceFetch, serviceEncodings) = \
+                parseServiceData(data, addr, self.fragments)
             if serviceName == "":   # message couldn't be parsed
                 continue
             # determine if this service should be processed based on watch and ignore lists
@@ -81,11 +142,18 @@ class RemoteClient(LogThread):
                 if serviceName not in list(self.services.keys()):
                     # service has not been seen before, create a new service proxy
                     debug('debugRemoteClientAdd', self.name, "adding", serviceName, serviceAddr, version, stateTimeStamp, resourceTimeStamp)
+                    sharedStates = None
+                    if self.sharedStates:
+                        sharedStates = SharedStateReader(serviceName)
+                        if not sharedStates.open(int(serviceAddr.split(":")[-1])):
+                            sharedStates = None     # not published on this host
                     self.services[serviceName] = ProxyService(serviceName+"Service",
                                                             RestInterface(serviceName+"Interface",
                                                                             serviceAddr=serviceAddr,
                                                                             event=self.event,
-                                                                            cache=self.cache),
+                                                                            cache=self.cache,
+                                                                            states=self.states.view(),
+                                                                            sharedStates=sharedStates),
                                                             version=version,
                                                             remoteClient=self,
                                                             label=serviceLabel,
@@ -102,28 +170,58 @@ class RemoteClient(LogThread):
                     if not service.enabled:     # the service was previously disabled but it is broadcasting again
                         debug('debugRemoteClientDisable', self.name, "reenabling", serviceName, serviceAddr, version, stateTimeStamp, resourceTimeStamp)
                         service.enable()
+                        service.resync = True   # the state cache was invalidated when it was disabled
+                service.interface.encodings = serviceEncodings   # state encodings that the service supports
+                # a delta advert only contains the states that changed since the previous advert
+                # if any adverts were missed the states of the service must be reloaded
+                if serviceChanges is not None:
+                    service.deltaAdverts = True
+                if service.logSeq(serviceSeq) and service.deltaAdverts:
+                    debug('debugRemoteClientStates', self.name, "missed delta advert", service.name, serviceSeq)
+                    service.resync = True
+                # packed states can't be decoded until the names have been read from the service
+                if isinstance(serviceStates, bytes):
+                    serviceStates = service.interface.unpackStates(serviceStates, fetch=False)
+                    if serviceStates is None:
+                        service.resync = True
+                if isinstance(serviceChanges, bytes):
+                    serviceChanges = service.interface.unpackStates(serviceChanges, fetch=False)
+                    if serviceChanges is None:
+                        service.resync = True
+                # the advert was too large to send so the resources or states must be read from the service
+                if "resources" in serviceFetch:
+                    service.reload = True
+                if set(serviceFetch) - {"resources"}:
+                    service.resync = True
+                if service.deltaAdverts and (serviceChanges is not None):
+                    # the changes are applied here and the states are up to date without reading them from the service
+                    # unless adverts were missed or the states haven't been loaded yet
+                    if serviceChanges:
+                        service.applyChanges(stateVersion, serviceChanges)
+                    if (not service.resync) and (service.stateTimeStamp >= 0):
+                        service.stateTimeStamp = max(stateTimeStamp, service.stateTimeStamp)
                 # load the resources or states in a separate thread if there was a change
-                if (resourceTimeStamp > service.resourceTimeStamp) or serviceResources or \
-                   (stateTimeStamp > service.stateTimeStamp) or serviceStates:
+                if (resourceTimeStamp > service.resourceTimeStamp) or serviceResources or service.reload or \
+                   (stateTimeStamp > service.stateTimeStamp) or serviceStates or service.resync:
                     if not service.updating:    # prevent multiple updates at the same time
                         service.updating = True
                         startThread(serviceName+"-update", self.updateService, args=(service, resourceTimeStamp, serviceResources,
-                                                                                stateTimeStamp, serviceStates,))
+                                                                                stateTimeStamp, stateVersion, serviceStates,))
                 # start the message timer
                 service.startTimer()
-                service.logSeq(serviceSeq)
             else:
                 debug('debugRemoteClient', self.name, "ignoring", serviceName, serviceAddr, stateTimeStamp, resourceTimeStamp)
         debug('debugThread', self.name, "terminated")
 
     # if resources have changed, update the resources for a service and add them to the local collection
     # if states have changed, update the states of the service resources
-    def updateService(self, service, resourceTimeStamp, serviceResources, stateTimeStamp, serviceStates):
+    def updateService(self, service, resourceTimeStamp, serviceResources, stateTimeStamp, stateVersion, serviceStates):
         debug('debugThread', threading.currentThread().name, "started")
         try:
-            if (resourceTimeStamp > service.resourceTimeStamp) or serviceResources:
+            if (resourceTimeStamp > service.resourceTimeStamp) or serviceResources or service.reload:
                 debug('debugRemoteClientUpdate', self.name, "updating resources", service.name, resourceTimeStamp)
-                for resource in list(service.resources.values()):
+                service.reload = False
+                for resource in service.resources.members():
                     debug('debugRemoteClientUpdate', self.name, "updating resources", service.name, "disabling", resource.name)
                     resource.disable()
                 service.load(serviceResources)
@@ -131,13 +229,22 @@ class RemoteClient(LogThread):
                 self.addLocalResources(service)
                 if self.resourceChanged:                # resource change callback
                     self.resourceChanged(service.name)
-            if (stateTimeStamp > service.stateTimeStamp) or serviceStates:
+            if (stateTimeStamp > service.stateTimeStamp) or serviceStates or service.resync:
                 debug('debugRemoteClientStates', self.name, "updating states", service.name, stateTimeStamp)
-                if not serviceStates:
-                    # if state values were not provided, get them from the service
-                    serviceStates = service.interface.getStates()
-                else:
-                    service.interface.setStates(serviceStates)  # load the interface cache
+                if service.resync:
+                    service.resync = False
+                    serviceStates = None    # states in the advert may be older than the missed changes
+                if not service.deltaAdverts:
+                    if not serviceStates:
+                        # if state values were not provided, get them from the service
+                        serviceStates = service.interface.getStates()
+                    else:
+                        service.interface.setStates(serviceStates)  # load the interface cache
+                elif not (serviceStates and service.applyStates(stateVersion, serviceStates)):
+                    # the states weren't in the advert or newer changes were applied since it was received, so read
+                    # them from the service and apply the changes that arrive in the meantime again if they are newer
+                    service.startSnapshot()
+                    service.applySnapshot(*service.interface.getSnapshot())
                 service.stateTimeStamp = stateTimeStamp
         except Exception as ex:
             logException(self.name+" updateService", ex)
@@ -1,12 +1,23 @@
 
 from picohttp import *
 from homealone import *
+from homealone.remote.sharedStates import *
+from homealone.remote.stateEncoding import *
 import json
+import base64
 import urllib.parse
 import threading
 import socket
 import time
 import struct
+import zlib
+
+# return the value of a request header regardless of the case of its name
+def requestHeader(request, name):
+    for (headerName, value) in request.headers.items():
+        if headerName.lower() == name.lower():
+            return value
+    return None
 
 # handle REST requests
 def requestHandler(request, response, service, resources):
@@ -14,8 +25,28 @@ def requestHandler(request, response, service, resources):
     debug('debugRemoteService', "type:", type, "resName:", resName, "attr:", attr)
     if request.method == "GET":
         data = None
-        if type == "":              # no path specified
-            data = ["service", "resources", "states"]
+        jsonData = None             # data that is already serialized
+        packedData = None           # states in the packed encoding
+        packed = request.query.get("encoding") == "packed"
+        # the resources and states have validators so clients can avoid reading them again if they haven't changed
+        # the resource timestamp distinguishes versions after the service restarts
+        etag = None
+        if (type == "resources") and not resName:
+            # the expanded resources are serialized every time if they contain resources with live values
+            # so the validator is derived from the content
+            version = resources.version
+            jsonData = resources.dumpJson("expand" in request.query)
+            if ("expand" in request.query) and (not resources.cacheDump):
+                etag = '"r%d-%08x"' % (service.resourceTimeStamp, zlib.crc32(jsonData.encode("utf-8")))
+            else:
+                etag = '"r%d-%d"' % (service.resourceTimeStamp, version)
+        elif type == "states":
+            etag = '"s%d-%d"' % (service.resourceTimeStamp, service.states.version)
+        ifNoneMatch = requestHeader(request, "If-None-Match")
+        if etag and ifNoneMatch and (etag in [value.strip() for value in ifNoneMatch.split(",")]):
+            response.status = 304   # not modified
+        elif type == "":            # no path specified
+            data = ["service", "resources", "states", "names"]
         elif type == "resources":   # resource definitions
             if resName:
                 try:                # resource was specified
@@ -26,21 +57,37 @@ def requestHandler(request, response, service, resources):
                          data = resource.dump()
                 except (KeyError, AttributeError):           # resource or attr not found
                     response.status = 404   # not found
-            else:                   # no resource was specified
-                if "expand" in request.query:   # expand the resources
-                    expand = True
-                else:                           # just return resource names
-                    expand = False
-                data = resources.dump(expand)
+            # if no resource was specified the serialized resources were built with their validator
         elif type == "states":   # resource states
-            data = service.states.getStates(wait=False)
+            if "since" in request.query:    # only the states that changed after the specified version
+                # all of them if the version is newer than the cache, such as when the client saw a previous run of the service
+                try:
+                    (version, changes) = service.states.getChangedStates(int(request.query["since"]))
+                    if packed:
+                        packedData = service.packStates(changes, version)
+                    else:
+                        data = {"version": version, "changes": changes}
+                except ValueError:
+                    response.status = 400   # bad request
+            elif packed:
+                packedData = service.packStates(service.states.getStates(wait=False), service.states.version)
+            else:
+                data = service.states.getStates(wait=False)
+        elif type == "names":   # resource names of packed states
+            data = service.getStateNames()
         elif type == "service":  # service data
             data = service.getServiceData()
         else:
             response.status = 404   # not found
         if response.status == 200:
-            response.headers["Content-Type"] = "application/json"
-            response.data = json.dumps(data)
+            if packedData is not None:
+                response.headers["Content-Type"] = "application/octet-stream"
+                response.data = packedData
+            else:
+                response.headers["Content-Type"] = "application/json"
+                response.data = jsonData if jsonData is not None else json.dumps(data)
+        if etag and (response.status in (200, 304)):
+            response.headers["ETag"] = etag
     elif request.method == "PUT":
         if (type == "resources") and resName and attr:   # resource and attr was specified
             try:
@@ -49,6 +96,8 @@ def requestHandler(request, response, service, resources):
                     request.data = json.loads(request.data)
                 debug('debugRemoteService', "data:", request.data)
                 resource.__setattr__(attr, request.data[attr])
+                if attr != "state":     # the definition of the resource changed
+                    resources.indexRes(resource)
             except (KeyError, AttributeError):           # resource or attr not found
                 response.status = 404   # not found
         else:
@@ -58,7 +107,8 @@ def requestHandler(request, response, service, resources):
 
 # Remote service interface
 class RemoteService(object):
-    def __init__(self, name, resources, states, port=None, advert=True, label=""):
+    def __init__(self, name, resources, states, port=None, advert=True, label="", sharedStates=False,
+                 deltaAdverts=False, packedAdverts=False):
         debug('debugRemoteService', name, "creating RemoteService", "advert:", advert)
         self.name = name
         self.resources = resources
@@ -71,10 +121,18 @@ class RemoteService(object):
         self.label = label
         self.advertSocket = None
         self.advertSequence = 0
+        self.advertLock = threading.Lock()
         self.stateTimeStamp = int(time.time())
         self.resourceTimeStamp = int(time.time())
         self.restServer = None
         self.faults = {}
+        self.sharedStates = sharedStates    # publish the states in shared memory for applications on this host
+        self.sharedStatePublisher = None
+        self.deltaAdverts = deltaAdverts    # adverts only contain the states that changed since the previous one
+        self.packedAdverts = packedAdverts  # adverts contain the states in the packed encoding
+        self.stateNames = []                # resource names of packed states
+        self.stateIndex = {}                # positions of the names in stateNames
+        self.stateNamesLock = threading.Lock()
 
     def start(self, block=True):
         # start the HTTP server
@@ -92,6 +150,12 @@ class RemoteService(object):
             debug('debugRemoteService', self.name, "sleeping for", restRetryInterval)
             time.sleep(restRetryInterval)
         debug('debugRemoteService', self.name, "RestServer started on port", self.port)
+        if self.sharedStates:
+            try:
+                self.sharedStatePublisher = SharedStatePublisher(self.name, self.states, self.port)
+                self.sharedStatePublisher.start()
+            except Exception as ex:
+                logException(self.name+" shared states", ex)
         if self.advert:
             if self.label == "":
                 self.label = hostname+":"+str(self.port)
@@ -121,39 +185,45 @@ class RemoteService(object):
         debug('debugRemoteService', self.name, "Remote state trigger started", remoteAdvertInterval)
         while True:
             time.sleep(remoteAdvertInterval)
-            self.sendAdvertMessage(None, None)
+            if self.deltaAdverts:   # an empty delta lets clients detect missed adverts
+                self.sendAdvertMessage(changes={})
+            else:
+                self.sendAdvertMessage(None, None)
         debug('debugRemoteService', self.name, "Remote state trigger ended")
 
     # send the advert message with states and/or resources if there was a change
     def stateAdvert(self):
         debug('debugRemoteService', self.name, "Advert thread started")
+        subscription = self.states.subscribe(self.name)
+        (version, states) = subscription.get(wait=False)    # the first get returns all the states
         resources = self.resources.dump()   # don't send expanded resources
-        states = self.states.getStates(wait=False)
-        self.sendAdvertMessage(resources, states)
-        lastStates = states
+        self.sendAdvertMessage(resources, states, version=version)
         while True:
             resources = None
-            states = None
-            # wait for a state to change
-            states = self.states.getStates(wait=True)
+            # wait for states to change
+            (version, changedStates) = subscription.get(wait=True)
             # a state changed
             self.stateTimeStamp = int(time.time())
             # fault if there is an invalid state
-            for resourceName in list(states.keys()):
-                if states[resourceName] is None:
+            for resourceName in list(changedStates.keys()):
+                if changedStates[resourceName] is None:
                     debug('debugRemoteService', resourceName, "Missing state")
                     self.setFault(resourceName, "missing state")
                 else:
                     self.clearFault(resourceName)
-            if sorted(list(states.keys())) != sorted(list(lastStates.keys())):
-                # a resource was either added or removed
+            if any(resourceName not in states for resourceName in changedStates):
+                # a resource was added
                 resources = self.resources.dump()   # don't send expanded resources
                 self.resourceTimeStamp = int(time.time())
-            self.sendAdvertMessage(resources, states)
-            lastStates = states
+            states.update(changedStates)
+            if self.deltaAdverts:
+                self.sendAdvertMessage(resources, changes=changedStates, version=version)
+            else:
+                self.sendAdvertMessage(resources, states, version=version)
         debug('debugRemoteService', self.name, "Advert thread ended")
 
-    def getServiceData(self):
+    # version is the state version of the states in an advert, otherwise the current version
+    def getServiceData(self, version=None):
         return {"name": self.name,
                "hostname": hostname,
                "port": self.port,
@@ -161,21 +231,81 @@ class RemoteService(object):
                "statetimestamp": self.stateTimeStamp,
                "resourcetimestamp": self.resourceTimeStamp,
                "seq": self.advertSequence,
+               "stateversion": self.states.version if version is None else version,
+               "stale": self.states.stale != set(),
+               "encodings": ["json", "packed"],
                "faults": self.faults}
 
-    def sendAdvertMessage(self, resources=None, states=None):
-        stateMsg = {"service": self.getServiceData()}
-        if resources:
-            stateMsg["resources"] = resources
-        if states:
-            stateMsg["states"] = states
+    # return the states in the packed encoding, adding the names of new resources to the list of names
+    def packStates(self, states, version=0):
+        with self.stateNamesLock:
+            for name in states.keys():
+                if name not in self.stateIndex:
+                    self.stateIndex[name] = len(self.stateNames)
+                    self.stateNames.append(name)
+            return packStates(states, self.stateIndex, self.resourceTimeStamp, version)
+
+    def getStateNames(self):
+        with self.stateNamesLock:
+            return {"timestamp": self.resourceTimeStamp, "names": list(self.stateNames)}
+
+    # states contains the states of all resources, changes only the states that changed since the previous advert
+    # and version is the state version they are from, which clients use to order delta adverts and REST responses
+    # an advert that is larger than a datagram is sent in fragments that each contain the service data
+    # if it would take too many fragments clients are told to read the resources and states via REST
+    def sendAdvertMessage(self, resources=None, states=None, changes=None, version=None):
+        with self.advertLock:   # the sequence numbers of delta adverts must be consecutive
+            if version is None:
+                version = self.states.version
+            stateMsg = {}
+            if resources:
+                stateMsg["resources"] = resources
+            if states:
+                stateMsg["states"] = states
+            if changes is not None:
+                stateMsg["changes"] = changes
+            if self.packedAdverts:
+                for item in ("states", "changes"):
+                    if item in stateMsg:
+                        stateMsg["packed"+item] = base64.b64encode(self.packStates(stateMsg.pop(item), version)).decode()
+            advert = json.dumps(dict({"service": self.getServiceData(version)}, **stateMsg))
+            if len(advert) <= remoteAdvertMaxSize:
+                self.sendAdvert(advert, list(stateMsg.keys()))
+            else:
+                fragments = self.fragmentAdvert(json.dumps(stateMsg))
+                if len(fragments) > remoteAdvertMaxFragments:
+                    debug('debugRemoteAdvert', self.name, "advert too large", len(advert))
+                    self.sendAdvert(json.dumps({"service": self.getServiceData(version), "fetch": list(stateMsg.keys())}), ["fetch"])
+                else:
+                    messageId = self.advertSequence
+                    for part in range(len(fragments)):
+                        self.sendAdvert(json.dumps({"service": self.getServiceData(version),
+                                                    "fragment": {"id": messageId, "part": part, "parts": len(fragments),
+                                                                 "data": fragments[part]}}), ["fragment"])
+
+    # split the serialized contents of an advert into pieces that fit in datagrams with the service data
+    # stop when there are more pieces than can be sent
+    def fragmentAdvert(self, data):
+        size = max(remoteAdvertMaxSize - len(json.dumps({"service": self.getServiceData(),
+                    "fragment": {"id": self.advertSequence, "part": remoteAdvertMaxFragments, "parts": remoteAdvertMaxFragments,
+                                 "data": ""}})) - 16, 256)  # allow for the sequence number to get longer
+        fragments = []
+        start = 0
+        while (start < len(data)) and (len(fragments) <= remoteAdvertMaxFragments):
+            length = size
+            while len(json.dumps(data[start:start + length])) - 2 > size:    # escaped characters are longer
+                length = min(length - 1, length * size // (len(json.dumps(data[start:start + length])) - 2))
+            fragments.append(data[start:start + length])
+            start += length
+        return fragments
+
+    def sendAdvert(self, advert, items):
         if not self.advertSocket:
             self.advertSocket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
             self.advertSocket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         try:
-            debug('debugRemoteAdvert', self.name, str(list(stateMsg.keys())))
-            self.advertSocket.sendto(bytes(json.dumps(stateMsg), "utf-8"),
-                                                (multicastAddr, remoteAdvertPort))
+            debug('debugRemoteAdvert', self.name, str(items), len(advert))
+            self.advertSocket.sendto(bytes(advert, "utf-8"), (multicastAddr, remoteAdvertPort))
         except socket.error as exception:
             log("socket error", str(exception))
             self.advertSocket = None
@@ -1,26 +1,31 @@
 import json
 import requests
+import requests.adapters
 import urllib.parse
 import sys
+import time
+import threading
 from homealone import *
-# from picohttp.httpClient import *
-
-# Custom hook to convert keys to integers
-def numericKeys2Int(pairs):
-    result = {}
-    for key, value in pairs:
-        if key.isnumeric():
-            result[int(key)] = value
-        else:
-            result[key] = value
-    return result
+from homealone.remote.stateEncoding import *
 
 class RestInterface(Interface):
-    def __init__(self, name, interface=None, event=None, serviceAddr="", cache=True, writeThrough=True):
+    def __init__(self, name, interface=None, event=None, serviceAddr="", cache=True, writeThrough=True, states=None,
+                 sharedStates=None):
         Interface.__init__(self, name, interface=interface, event=event)
+        if states is not None:              # keep the state cache in a shared StateTable
+            self.states = states
+        self.sharedStates = sharedStates    # SharedStateReader if the service is on this host
         self.cache = cache                  # cache the states
         self.writeThrough = writeThrough    # cache is write through
         self.enabled = False
+        self.encodings = ["json"]           # state encodings that the service supports
+        self.names = []                     # resource names of packed states
+        self.namesTimeStamp = None          # resource timestamp of the service when the names were read
+        self.session = None                 # keep-alive HTTP connections to the service
+        self.sessionTime = 0                # the last time the session was used
+        self.sessionRequests = 0            # number of requests that are using the session
+        self.sessionLock = threading.Lock()
+        self.validators = {}                # ETag and data of the last response by URL
         self.setServiceAddr(serviceAddr)
         debug('debugRest', self.name, "created", self.serviceAddr)
 
@@ -32,6 +37,7 @@ class RestInterface(Interface):
         if self.enabled:
             self.enabled = False
             debug('debugRest', self.name, "stopping")
+            self.closeSession()
             # invalidate the state cache
             for state in list(self.states.keys()):
                 self.states[state] = None
@@ -39,8 +45,38 @@ class RestInterface(Interface):
     # update the service address
     def setServiceAddr(self, serviceAddr):
         self.serviceAddr = serviceAddr      # address of the REST service to target (ipAddr:port)
-        # (ipAddr, port) = self.serviceAddr.split(":")
-        # self.client = HttpClient(ipAddr, int(port))
+        if self.sharedStates and serviceAddr:   # the service may have been restarted
+            self.sharedStates.open(int(serviceAddr.split(":")[-1]))
+        self.closeSession()                 # don't reuse connections to the previous address
+        self.validators = {}
+
+    # return the session for a request to the service, releaseSession() must be called when the request is done
+    # a session that hasn't been used for a while is replaced because the service may have closed its connections
+    # it isn't replaced while another request is still using it
+    def getSession(self):
+        with self.sessionLock:
+            now = time.monotonic()
+            if self.session and (self.sessionRequests == 0) and (now - self.sessionTime > restIdleTimeout):
+                debug('debugRest', self.name, "closing idle session")
+                self.session.close()
+                self.session = None
+            if not self.session:
+                self.session = requests.Session()
+                self.session.mount("http://", requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=restPoolSize))
+            self.sessionTime = now
+            self.sessionRequests += 1
+            return self.session
+
+    def releaseSession(self):
+        with self.sessionLock:
+            self.sessionTime = time.monotonic()
+            self.sessionRequests -= 1
+
+    def closeSession(self):
+        with self.sessionLock:
+            if self.session:
+                self.session.close()
+                self.session = None
 
     # disable the RestService that uses this interface
     def disableService(self):
@@ -52,45 +88,151 @@ class RestInterface(Interface):
 
     # return state values of all sensors on this interface and store them in the cache
     def getStates(self, path="/states"):
-        debug('debugRemoteClientStates', self.name, "getStates", "path", path)
-        states = self.readRest(path)
-        debug('debugRemoteClientStates', self.name, "getStates", "states", states)
+        if traceFlags.debugRemoteClientStates:
+            trace('debugRemoteClientStates', self.name, "getStates", "path", path)
+        if self.sharedStates and self.sharedStates.isOpen() and (path == "/states"):
+            states = self.sharedStates.readAll()
+        else:
+            states = self.readRest(path, packed=(path == "/states"))
+        if traceFlags.debugRemoteClientStates:
+            trace('debugRemoteClientStates', self.name, "getStates", "states", states)
         self.setStates(states)
         return states
 
+    # return the state version of the service and the states of all sensors read from the service
+    # the states aren't stored in the cache so the caller can order them with other changes
+    # the names are also read so that packed delta adverts can be decoded
+    def getSnapshot(self):
+        data = self.readRest("/states", query={"since": 0})
+        try:
+            if "packed" in self.encodings:
+                self.readNames()
+            return (data["version"], data["changes"])
+        except (KeyError, TypeError):
+            return (0, {})
+
     # set state values of all sensors into the cache
     def setStates(self, states):
-        debug('debugRemoteClientStates', self.name, "setStates", "states", states)
-        for sensor in list(states.keys()):
-            self.states[sensor] = states[sensor]
+        if traceFlags.debugRemoteClientStates:
+            trace('debugRemoteClientStates', self.name, "setStates", "states", states)
+        self.states.update(states)
         self.notify()
 
     # return the state value for the specified sensor address
     # addr is the REST path to the specified resource
     def read(self, addr):
-        debug('debugRemoteClientRead', self.name, "read", addr, self.states)
+        if traceFlags.debugRemoteClientRead:
+            trace('debugRemoteClientRead', self.name, "read", addr, lambda: self.states.copy())
         if not self.enabled:
             return None
         # return the state from the cache if it is there, otherwise read it from the service
         if (not self.cache) or (self.states[addr] == None):
+            if self.sharedStates:
+                try:
+                    self.states[addr] = self.sharedStates.read(addr)
+                    return self.states[addr]
+                except KeyError:            # not shared, read it from the service
+                    pass
             try:
                 self.states[addr] = self.readRest("/resources/"+addr+"/state")["state"]
             except KeyError:
                 self.states[addr] = None
         return self.states[addr]
 
+    # return the state values for a list of sensor addresses
+    # if more than one of them isn't in the cache get all the states from the service in one request
+    def readMany(self, addrs):
+        if traceFlags.debugRemoteClientRead:
+            trace('debugRemoteClientRead', self.name, "readMany", addrs)
+        if not self.enabled:
+            return [None for addr in addrs]
+        missing = [addr for addr in addrs if (not self.cache) or (self.states.get(addr) is None)]
+        if len(missing) > 1:
+            # load the cache without a notification because the caller is already reading the states
+            if self.sharedStates and self.sharedStates.isOpen():
+                states = self.sharedStates.readAll()
+                # states that aren't shared or are too large to be shared are read from the service
+                unshared = [addr for addr in missing if addr not in states]
+                if len(unshared) > 1:
+                    restStates = self.readRest("/states", packed=True)
+                    states.update({addr: restStates.get(addr) for addr in unshared})
+                elif unshared:
+                    states[unshared[0]] = self.read(unshared[0])
+            else:
+                states = self.readRest("/states", packed=True)
+            self.states.update({addr: states.get(addr) for addr in missing})
+            return [self.states.get(addr) for addr in addrs]
+        else:
+            return [self.read(addr) for addr in addrs]
+
+    # return the states from packed states, reading the names from the service if they aren't known
+    # return None if the names aren't known and fetch is False
+    def unpackStates(self, data, fetch=True):
+        try:
+            (timeStamp, version, count) = unpackHeader(data)
+            if timeStamp == self.namesTimeStamp:
+                try:
+                    return unpackStates(data, self.names)[2]
+                except IndexError:      # names were added since they were read
+                    pass
+            if not fetch:
+                return None
+            self.readNames()
+            return unpackStates(data, self.names)[2]
+        except (ValueError, KeyError, IndexError) as ex:
+            log(self.name, "invalid packed states", str(ex))
+            return None if not fetch else {}
+
+    # read the resource names of packed states from the service
+    def readNames(self):
+        names = self.readRest("/names")
+        (self.names, self.namesTimeStamp) = (names["names"], names["timestamp"])
+
     # read the json data from the specified path and return a dictionary
-    def readRest(self, path):
-        debug('debugRemoteClientRead', self.name, "readRest", path)
+    # if packed is True and the service supports it, the states are read in the packed encoding
+    # if the service returned an ETag the last time the path was read, the data from that time is
+    # returned if the service responds that it hasn't changed
+    # query is an optional dictionary of query parameters
+    def readRest(self, path, packed=False, query=None):
+        if traceFlags.debugRemoteClientRead:
+            trace('debugRemoteClientRead', self.name, "readRest", path)
         try:
-            ####################################################################
             url = "http://"+self.serviceAddr+urllib.parse.quote(path)
-            debug('debugRestGet', self.name, "GET", url)
-            response = requests.get(url, timeout=restTimeout)
-            debug('debugRestGet', self.name, "status", response.status_code)
-            if response.status_code == 200:
-                debug('debugRestGet', self.name, "response", response.json())
-                return json.loads(response.text, object_pairs_hook=numericKeys2Int)
+            packed = packed and ("packed" in self.encodings)
+            query = dict(query) if query else {}
+            if packed:
+                query["encoding"] = "packed"
+            if query:
+                url += "?"+urllib.parse.urlencode(query)
+            headers = {}
+            validator = self.validators.get(url)
+            if validator:
+                headers["If-None-Match"] = validator[0]
+            if traceFlags.debugRestGet:
+                trace('debugRestGet', self.name, "GET", url, headers)
+            session = self.getSession()
+            try:
+                response = session.get(url, headers=headers, timeout=restTimeout)
+            finally:
+                self.releaseSession()
+            if traceFlags.debugRestGet:
+                trace('debugRestGet', self.name, "status", response.status_code)
+            if (response.status_code == 304) and validator:     # not modified
+                return validator[1]
+            elif response.status_code == 200:
+                if packed:
+                    data = self.unpackStates(response.content)
+                else:
+                    if traceFlags.debugRestGet:
+                        trace('debugRestGet', self.name, "response", response.text)
+                    data = json.loads(response.text, object_pairs_hook=numericKeys2Int)
+                if ("ETag" in response.headers) and (data or not packed):   # don't keep packed states that couldn't be read
+                    with self.sessionLock:
+                        self.validators.pop(url, None)
+                        if len(self.validators) >= restValidators:
+                            del self.validators[next(iter(self.validators))]
+                        self.validators[url] = (response.headers["ETag"], data)
+                return data
             else:
                 log(self.name, "read status", response.status_code, url)
                 self.disableService()
@@ -103,25 +245,8 @@ class RestInterface(Interface):
             log(self.name, "read state connection error", self.serviceAddr, path)
             self.disableService()
             return {}
-            ####################################################################
-            # debug('debugRestGet', self.name, "GET", self.serviceAddr+path)
-            # response = self.client.get(path)
-            # debug('debugRestGet', self.name, "status", response.status)
-            # if response.status == 200:
-            #     debug('debugRestGet', self.name, "data", response.data)
-            #     if response.data:
-            #         return json.loads(response.data)
-            #     else:
-            #         return {}
-            # elif response.status == 0:
-            #     log(self.name, "read exception", response.data)
-            #     self.disableService()
-            # else:
-            #     log(self.name, "read status", response.status)
-            #     return {}
-            ####################################################################
         except Exception as ex:
-            logException(self.name+" uncaught read exception "+self.serviceAddr, str(ex))
+            logException(self.name+" uncaught read exception "+self.serviceAddr, ex)
             self.disableService()
             return {}
 
@@ -149,33 +274,21 @@ class RestInterface(Interface):
     def writeRest(self, path, data):
         debug('debugRemoteClientWrite', self.name, "writeRest", path, data)
         try:
-            ####################################################################
             url = "http://"+self.serviceAddr+urllib.parse.quote(path)
             debug('debugRestPut', self.name, "PUT", url, "data:", data)
-            response = requests.put(url,
-                             headers={"Content-type":"application/json"},
-                             data=data)
+            session = self.getSession()
+            try:
+                response = session.put(url,
+                                       headers={"Content-type":"application/json"},
+                                       data=data, timeout=restTimeout)
+            finally:
+                self.releaseSession()
             debug('debugRestPut', self.name, "status", response.status_code)
             if response.status_code == 200:
                 return True
             else:
                 log(self.name, "write status", response.status_code, url)
                 return False
-            ####################################################################
-            # debug('debugRestPut', self.name, "PUT", self.serviceAddr+path, "data:", data)
-            # response = self.client.put(path,
-            #                  headers={"Content-type":"application/json"},
-            #                  data=data)
-            # debug('debugRestPut', self.name, "status", response.status)
-            # if response.status == 200:
-            #     return True
-            # elif response.status == 0:
-            #     log(self.name, "write exception", response.data)
-            #     self.disableService()
-            # else:
-            #     log(self.name, "write status", response.status)
-            #     return False
-            ####################################################################
         except Exception as ex:
             logException(self.name+" uncaught write exception "+self.serviceAddr, ex)
             self.disableService()
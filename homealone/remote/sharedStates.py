@@ -0,0 +1,279 @@
+from homealone import *
+import json
+import struct
+import time
+import threading
+import atexit
+from multiprocessing import shared_memory
+
+# Resource states shared between applications on the same host
+
+# The states of a service are published in a shared memory segment named after the service.
+# The segment contains a header, an index of the slot that holds the state of each resource,
+# and a fixed size slot for each resource.  The index and each slot are protected by a sequence
+# lock that the publisher increments before and after it changes them.  A reader retries if the
+# sequence number is odd or changes while it is reading.
+#
+# header:   magic, REST port of the service, open flag, number of slots, slot size, index size, index seq
+# index:    length, JSON dictionary of slot numbers by resource name
+# slot:     seq, value type, value length, value
+
+sharedStateMagic = b"HAst"
+headerFormat = "<4sIIIIIQ"
+headerSize = struct.calcsize(headerFormat)
+indexHeaderFormat = "<I"
+slotHeaderFormat = "<QBxxxI"
+slotHeaderSize = struct.calcsize(slotHeaderFormat)
+
+# types of slot values
+typeMissing = 0
+typeNone = 1
+typeInt = 2
+typeFloat = 3
+typeStr = 4
+typeJson = 5
+typeTooLarge = 6            # the state doesn't fit in the slot and must be read from the service
+
+# return the name of the shared memory segment for a service
+def sharedStateSegment(serviceName):
+    return "homealone."+serviceName
+
+# return the type and encoded value of a state
+def encodeState(state):
+    if state is None:
+        return (typeNone, b"")
+    elif isinstance(state, bool):
+        return (typeInt, struct.pack("<q", int(state)))
+    elif isinstance(state, int) and (-2**63 <= state < 2**63):
+        return (typeInt, struct.pack("<q", state))
+    elif isinstance(state, float):
+        return (typeFloat, struct.pack("<d", state))
+    elif isinstance(state, str):
+        return (typeStr, state.encode("utf-8"))
+    else:
+        return (typeJson, json.dumps(state).encode("utf-8"))
+
+# Custom hook to convert keys to integers
+def numericKeys2Int(pairs):
+    result = {}
+    for key, value in pairs:
+        if key.isnumeric():
+            result[int(key)] = value
+        else:
+            result[key] = value
+    return result
+
+# return the state from an encoded value
+def decodeState(valueType, value):
+    if valueType == typeInt:
+        return struct.unpack("<q", value)[0]
+    elif valueType == typeFloat:
+        return struct.unpack("<d", value)[0]
+    elif valueType == typeStr:
+        return value.decode("utf-8")
+    elif valueType == typeJson:
+        return json.loads(value.decode("utf-8"), object_pairs_hook=numericKeys2Int)
+    else:
+        return None
+
+# publish the states in a StateCache to a shared memory segment
+class SharedStatePublisher(object):
+    def __init__(self, name, states, port, slots=None, slotSize=None, indexSize=None):
+        self.name = name
+        self.states = states
+        self.port = port
+        self.nSlots = slots if slots else sharedStateSlots
+        self.slotSize = slotSize if slotSize else sharedStateSlotSize
+        self.indexSize = indexSize if indexSize else sharedStateIndexSize
+        self.slotBase = headerSize + self.indexSize
+        self.index = {}         # slot number of each resource by name
+        self.indexSeq = 0
+        self.segment = None
+
+    def start(self):
+        segmentName = sharedStateSegment(self.name)
+        try:            # remove a segment left by a previous instance that didn't exit cleanly
+            oldSegment = shared_memory.SharedMemory(name=segmentName)
+            # mark it closed so readers that have it mapped open the new one
+            if bytes(oldSegment.buf[0:4]) == sharedStateMagic:
+                struct.pack_into("<I", oldSegment.buf, 8, 0)
+            oldSegment.close()
+            oldSegment.unlink()
+        except FileNotFoundError:
+            pass
+        self.segment = shared_memory.SharedMemory(name=segmentName, create=True,
+                                                  size=self.slotBase + self.nSlots * (slotHeaderSize + self.slotSize))
+        self.writeIndex()
+        struct.pack_into(headerFormat, self.segment.buf, 0, sharedStateMagic, self.port, 1,
+                         self.nSlots, self.slotSize, self.indexSize, self.indexSeq)
+        atexit.register(self.stop)
+        debug('debugSharedStates', self.name, "publishing states in", segmentName)
+        startThread("sharedStateThread", self.sharedStateThread)
+
+    # mark the segment closed and remove it
+    def stop(self):
+        if self.segment:
+            struct.pack_into("<I", self.segment.buf, 8, 0)
+            self.segment.close()
+            try:
+                self.segment.unlink()
+            except FileNotFoundError:
+                pass
+            self.segment = None
+
+    # copy the states into the segment when they change
+    def sharedStateThread(self):
+        subscription = self.states.subscribe(self.name+"-shared")
+        while self.segment:
+            (version, changedStates) = subscription.get()
+            debug('debugSharedStates', self.name, "publishing", len(changedStates), "states", version)
+            newNames = [name for name in changedStates.keys() if name not in self.index]
+            if newNames:
+                for name in newNames:
+                    if len(self.index) == self.nSlots:
+                        log(self.name, "no shared state slots for", len(newNames), "resources")
+                        break
+                    self.index[name] = len(self.index)
+                self.writeIndex()
+            for (name, state) in changedStates.items():
+                if name in self.index:
+                    self.writeSlot(self.index[name], state)
+
+    # write the index with its sequence lock
+    def writeIndex(self):
+        data = json.dumps(self.index).encode("utf-8")
+        if len(data) + struct.calcsize(indexHeaderFormat) > self.indexSize:
+            log(self.name, "shared state index is too large", len(data))
+            return
+        self.setIndexSeq(self.indexSeq + 1)
+        struct.pack_into(indexHeaderFormat, self.segment.buf, headerSize, len(data))
+        start = headerSize + struct.calcsize(indexHeaderFormat)
+        self.segment.buf[start:start + len(data)] = data
+        self.setIndexSeq(self.indexSeq + 1)
+
+    def setIndexSeq(self, seq):
+        self.indexSeq = seq
+        struct.pack_into("<Q", self.segment.buf, headerSize - 8, seq)
+
+    # write the state of a resource into a slot with its sequence lock
+    def writeSlot(self, slot, state):
+        (valueType, value) = encodeState(state)
+        if len(value) > self.slotSize:
+            (valueType, value) = (typeTooLarge, b"")
+        offset = self.slotBase + slot * (slotHeaderSize + self.slotSize)
+        buf = self.segment.buf
+        seq = struct.unpack_from("<Q", buf, offset)[0]
+        struct.pack_into("<Q", buf, offset, seq + 1)
+        buf[offset + slotHeaderSize:offset + slotHeaderSize + len(value)] = value
+        struct.pack_into(slotHeaderFormat, buf, offset, seq + 1, valueType, len(value))
+        struct.pack_into("<Q", buf, offset, seq + 2)
+
+# read the states that another application on this host publishes in shared memory
+class SharedStateReader(object):
+    def __init__(self, name):
+        self.name = name
+        self.segment = None
+        self.port = None
+        self.openTime = 0       # the last time the segment was opened
+        self.index = {}
+        self.indexSeq = None
+
+    # map the segment of the service if it exists and is published by the service on the specified port
+    def open(self, port=None):
+        self.close()
+        self.port = port
+        self.openTime = time.monotonic()
+        try:
+            try:
+                segment = shared_memory.SharedMemory(name=sharedStateSegment(self.name), track=False)
+            except TypeError:   # python < 3.13 tracks segments and removes them when the reader exits
+                segment = shared_memory.SharedMemory(name=sharedStateSegment(self.name))
+                from multiprocessing import resource_tracker
+                resource_tracker.unregister(segment._name, "shared_memory")
+        except FileNotFoundError:
+            return False
+        (magic, segmentPort, isOpen, self.nSlots, self.slotSize, indexSize, indexSeq) = \
+            struct.unpack_from(headerFormat, segment.buf, 0)
+        if (magic != sharedStateMagic) or (not isOpen) or (port and (segmentPort != port)):
+            segment.close()
+            return False
+        self.segment = segment
+        self.slotBase = headerSize + indexSize
+        self.index = {}
+        self.indexSeq = None
+        debug('debugSharedStates', self.name, "reading states from", sharedStateSegment(self.name))
+        return True
+
+    def close(self):
+        if self.segment:
+            self.segment.close()
+            self.segment = None
+
+    # return True if the segment is mapped and the publisher hasn't closed it
+    # if it was closed, the service may have been restarted so try to open the segment of the new instance
+    def isOpen(self):
+        if (self.segment is not None) and (struct.unpack_from("<I", self.segment.buf, 8)[0] == 1):
+            return True
+        if time.monotonic() - self.openTime > sharedStateReopenInterval:
+            return self.open(self.port)
+        return False
+
+    # reload the index if the publisher changed it
+    # return False if it couldn't be read because the publisher kept changing it
+    def readIndex(self):
+        buf = self.segment.buf
+        for retry in range(sharedStateReadRetries):
+            seq = struct.unpack_from("<Q", buf, headerSize - 8)[0]
+            if seq == self.indexSeq:
+                return True
+            if seq & 1:
+                continue
+            length = struct.unpack_from(indexHeaderFormat, buf, headerSize)[0]
+            start = headerSize + struct.calcsize(indexHeaderFormat)
+            data = bytes(buf[start:start + length])
+            if struct.unpack_from("<Q", buf, headerSize - 8)[0] == seq:
+                self.index = json.loads(data.decode("utf-8"))
+                self.indexSeq = seq
+                return True
+        debug('debugSharedStates', self.name, "index is busy")
+        return False
+
+    # return the state of a resource
+    # raises KeyError if the state isn't published, is too large to be shared, or the publisher kept changing it
+    # so it must be read from the service
+    def read(self, name):
+        if not self.isOpen():
+            raise KeyError(name)
+        try:
+            slot = self.index[name]
+        except KeyError:
+            self.readIndex()
+            slot = self.index[name]
+        buf = self.segment.buf
+        offset = self.slotBase + slot * (slotHeaderSize + self.slotSize)
+        for retry in range(sharedStateReadRetries):
+            (seq, valueType, length) = struct.unpack_from(slotHeaderFormat, buf, offset)
+            if seq & 1:
+                continue
+            value = bytes(buf[offset + slotHeaderSize:offset + slotHeaderSize + length])
+            if struct.unpack_from("<Q", buf, offset)[0] == seq:
+                break
+        else:
+            debug('debugSharedStates', self.name, "slot of", name, "is busy")
+            raise KeyError(name)
+        if valueType in (typeMissing, typeTooLarge):
+            raise KeyError(name)
+        return decodeState(valueType, value)
+
+    # return a dictionary of all the states that are published
+    def readAll(self):
+        if not self.isOpen():
+            return {}
+        self.readIndex()
+        states = {}
+        for name in list(self.index.keys()):
+            try:
+                states[name] = self.read(name)
+            except KeyError:
+                pass
+        return states
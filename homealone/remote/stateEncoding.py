@@ -0,0 +1,122 @@
+from homealone import *
+from homealone.remote.sharedStates import *
+import json
+import struct
+
+# Packed encoding of resource states
+
+# Instead of a JSON dictionary of states by resource name, the states are identified by the index of the
+# resource name in a list of names.  A service only appends names to the list, so a client only has to
+# read it again if the resource timestamp of the service changes or the states contain an index it
+# doesn't know.  The states are grouped by the type of their value so that the indexes and values of
+# each group can be packed and unpacked with one struct call.  The value types are the same as the
+# types that are used for shared states with the addition of small ints and booleans.
+#
+# header:   magic, resource timestamp of the names, state version, number of groups
+# group:    value type, number of states, indexes, values
+#
+# Ints that fit in 32 bits are 4 bytes, other int and float values are 8 bytes, booleans and None have
+# no values, and str and JSON values are a list of lengths followed by the encoded values.
+
+packedMagic = b"HApk"
+packedHeader = struct.Struct("<4sQQI")
+packedGroup = struct.Struct("<BI")
+
+# value types in addition to the shared state types
+typeSmallInt = 16
+typeFalse = 17
+typeTrue = 18
+
+# struct formats of the types with fixed size values
+packedFormats = {typeSmallInt: "i", typeInt: "q", typeFloat: "d"}
+# values of the types without values
+packedConstants = {typeNone: None, typeFalse: False, typeTrue: True}
+
+# return the type of the packed encoding of a state
+def packedType(state):
+    if isinstance(state, bool):         # keep booleans distinct from ints
+        return typeTrue if state else typeFalse
+    elif isinstance(state, int):
+        if -2**31 <= state < 2**31:
+            return typeSmallInt
+        elif -2**63 <= state < 2**63:
+            return typeInt
+        else:
+            return typeJson
+    elif isinstance(state, float):
+        return typeFloat
+    elif state is None:
+        return typeNone
+    elif isinstance(state, str):
+        return typeStr
+    else:
+        return typeJson
+
+# return the packed encoding of a dictionary of states
+# index is a dictionary of the positions of resource names in the list of names
+def packStates(states, index, timeStamp, version=0):
+    groups = {}     # indexes and states by type
+    for (name, state) in states.items():
+        valueType = packedType(state)
+        try:
+            group = groups[valueType]
+        except KeyError:
+            group = groups[valueType] = ([], [])
+        group[0].append(index[name])
+        group[1].append(state)
+    data = [packedHeader.pack(packedMagic, timeStamp, version, len(groups))]
+    for (valueType, (indexes, values)) in groups.items():
+        count = len(indexes)
+        data.append(packedGroup.pack(valueType, count))
+        data.append(struct.pack("<%dI" % count, *indexes))
+        if valueType in packedFormats:
+            data.append(struct.pack("<%d%s" % (count, packedFormats[valueType]), *values))
+        elif valueType not in packedConstants:
+            if valueType == typeStr:
+                values = [value.encode("utf-8") for value in values]
+            else:
+                values = [json.dumps(value).encode("utf-8") for value in values]
+            data.append(struct.pack("<%dI" % count, *[len(value) for value in values]))
+            data.extend(values)
+    return b"".join(data)
+
+# return the resource timestamp, state version, and number of groups of packed states
+# raises ValueError if the data isn't packed states
+def unpackHeader(data):
+    try:
+        (magic, timeStamp, version, nGroups) = packedHeader.unpack_from(data, 0)
+    except struct.error:
+        raise ValueError("packed states are too short")
+    if magic != packedMagic:
+        raise ValueError("not packed states")
+    return (timeStamp, version, nGroups)
+
+# return the resource timestamp, state version and dictionary of states from packed states
+# raises IndexError if the states contain an index that isn't in names
+def unpackStates(data, names):
+    (timeStamp, version, nGroups) = unpackHeader(data)
+    states = {}
+    offset = packedHeader.size
+    try:
+        for group in range(nGroups):
+            (valueType, count) = packedGroup.unpack_from(data, offset)
+            offset += packedGroup.size
+            indexes = struct.unpack_from("<%dI" % count, data, offset)
+            offset += 4 * count
+            if valueType in packedFormats:
+                valueFormat = struct.Struct("<%d%s" % (count, packedFormats[valueType]))
+                values = valueFormat.unpack_from(data, offset)
+                offset += valueFormat.size
+            elif valueType in packedConstants:
+                values = [packedConstants[valueType]] * count
+            else:
+                lengths = struct.unpack_from("<%dI" % count, data, offset)
+                offset += 4 * count
+                values = []
+                for length in lengths:
+                    values.append(decodeState(valueType, data[offset:offset + length]))
+                    offset += length
+            states.update(zip([names[index] for index in indexes], values))
+    except struct.error:
+        raise ValueError("packed states are truncated")
+    return (timeStamp, version, states)
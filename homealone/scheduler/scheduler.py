@@ -135,6 +135,11 @@ class Job(Control):
         # self.notify()
         debug('debugJob', self.name, "stopped")
 
+    # the serialized object includes the states of the sensors that set the durations of tasks
+    @property
+    def cacheDump(self):
+        return not any(isinstance(task, Task) and isinstance(task.duration, Sensor) for task in self.taskList)
+
     # attributes to include in the serialized object
     def dict(self, expand=False):
         attrs = Control.dict(self)
@@ -163,8 +168,7 @@ class Scheduler(Collection):
     # initialize control states in certain cases
     def initControls(self):
         (now, tomorrow) = todaysDate()
-        for scheduleName in list(self.keys()):
-            schedule = self[scheduleName]
+        for schedule in self.members():
             # schedule must have an end time
             if schedule.endTime:
                 # schedule must recur daily at a specific time
@@ -195,9 +199,9 @@ class Scheduler(Collection):
             debug('debugScheduler', self.name, "waking up",
                     now.year, now.month, now.day, now.hour, now.minute, now.weekday())
             # run through the schedule and check if any tasks should be run
-            # need to handle cases where the schedule could be modified while this is running - FIXME
-            for scheduleName in list(self.keys()):
-                schedule = self[scheduleName]
+            # the snapshot of the schedules isn't affected if they are modified while this is running
+            for schedule in self.members():
+                scheduleName = schedule.name
                 if schedule.getState():
                     if self.shouldRun(scheduleName, schedule.schedTime, now):
                         self.setControlState(schedule, schedule.controlState)
@@ -0,0 +1,58 @@
+# Debug tracing for code that runs frequently
+
+# debug() looks up its flag by name and evaluates all of its arguments every time it is called,
+# even if the flag is off.  A trace flag is an attribute of traceFlags that is True if the flag is
+# set in debugConf, so checking it costs a single attribute lookup when tracing is off:
+#
+#     if traceFlags.debugGPIORead:
+#         trace("debugGPIORead", self.name, "value:", "0x%02x" % byte)
+#
+# trace() can also be called without checking the flag first.  Arguments that are functions, such as
+# lambdas, are only called if the flag is on:
+#
+#     trace("debugGPIORead", self.name, "value:", lambda: "0x%02x" % byte)
+#
+# Flags in disabledTraceFlags are always off even if they are set in debugConf so that
+# the tracing in the code they guard can never run.
+#
+# Each flag is read from the debug configuration the first time it is checked and then kept in
+# traceFlags so that checking it doesn't cost more than an attribute lookup.  A flag that is changed
+# while the application is running must be set through traceFlags, which also sets it for debug():
+#
+#     traceFlags.debugGPIORead = True
+#
+# or traceFlags.reset() must be called after the flags of the rutifu module are changed directly,
+# otherwise trace() and the checks of traceFlags keep the old values.
+
+import types
+from rutifu import *
+import rutifu.rutifu as rutifuGlobals  # the debug flags are globals of the rutifu module
+from .env import *
+
+class TraceFlags(object):
+    def __init__(self, disabled=[]):
+        object.__setattr__(self, "disabled", set(disabled))
+
+    # called the first time a flag is checked, after that it is found in the instance
+    def __getattr__(self, flag):
+        value = (flag not in self.disabled) and bool(getattr(rutifuGlobals, flag, False))
+        object.__setattr__(self, flag, value)
+        return value
+
+    # turn a flag on or off for both trace() and debug()
+    def __setattr__(self, flag, value):
+        setattr(rutifuGlobals, flag, value)
+        object.__setattr__(self, flag, (flag not in self.disabled) and bool(value))
+
+    # forget the cached flags after the debug configuration was changed
+    def reset(self):
+        disabled = self.disabled
+        self.__dict__.clear()
+        object.__setattr__(self, "disabled", disabled)
+
+traceFlags = TraceFlags(disabledTraceFlags)
+
+# log a message if the flag is on, calling the arguments that are functions
+def trace(flag, *args):
+    if getattr(traceFlags, flag):
+        log(*[(arg() if isinstance(arg, types.FunctionType) else arg) for arg in args])
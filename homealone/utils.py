@@ -1,120 +1,855 @@
 # Utility functions
 
-pollResolution = 10 # how many times per second to possibly check for resource state changes
+pollResolution = 10 # maximum number of times per second that a resource may be polled
 
 import syslog
+import sys
 import os
 import time
 import threading
 import traceback
 import json
 import copy
+import collections
+import concurrent.futures
+import heapq
+import bisect
+import itertools
 import subprocess
 from rutifu import *
 from .core import *
 from .env import *
+from .tracing import *
+from .lockProfiler import *
+
+# Sensors on one interface that are due to be polled
+# Only one worker reads a partition at a time so the interface is always accessed serially
+class PollPartition(object):
+    def __init__(self, name):
+        self.name = name
+        self.lock = threading.Lock()
+        self.entries = []       # poll queue entries waiting to be read
+        self.running = False    # a worker is reading the entries
+        self.lag = 0.0          # how late the last poll was in seconds
+        self.maxLag = 0.0       # the latest a poll has been in seconds
+        self.readTime = None    # when the read that is in progress was started
+
+    # add entries to the partition and return True if a worker needs to be started to read them
+    def queue(self, entries):
+        with self.lock:
+            self.entries += entries
+            if self.running:
+                return False
+            self.running = True
+            return True
+
+    # return the entries waiting to be read, or an empty list when the worker should stop
+    def take(self):
+        with self.lock:
+            (entries, self.entries) = (self.entries, [])
+            if not entries:
+                self.running = False
+            return entries
+
+    # stop the worker without reading the entries, such as after an error
+    def stop(self):
+        with self.lock:
+            self.running = False
+
+    def logLag(self, lag):
+        self.lag = lag
+        self.maxLag = max(self.maxLag, lag)
+
+    # return the lag statistics, including how long the current read has been blocked
+    def getLag(self):
+        with self.lock:
+            readTime = self.readTime
+            return {"lag": self.lag, "maxLag": self.maxLag, "waiting": len(self.entries),
+                    "busy": (time.monotonic() - readTime) if readTime else 0.0}
+
+# Counts and a fixed bucket histogram of the times taken by an operation
+class ReadStats(object):
+    def __init__(self, name, buckets=None):
+        self.name = name
+        self.buckets = buckets if buckets else readStatsBuckets    # upper bounds of the buckets in seconds
+        self.lock = threading.Lock()
+        self.counts = [0] * (len(self.buckets) + 1)    # the last bucket counts times above the highest bound
+        self.reads = 0
+        self.errors = 0
+        self.totalTime = 0.0
+        self.maxTime = 0.0
+
+    def record(self, elapsed, error=False):
+        with self.lock:
+            self.counts[bisect.bisect_left(self.buckets, elapsed)] += 1
+            self.reads += 1
+            if error:
+                self.errors += 1
+            self.totalTime += elapsed
+            self.maxTime = max(self.maxTime, elapsed)
+
+    # return the upper bound of the bucket that contains the specified fraction of the times
+    def percentile(self, fraction):
+        target = fraction * self.reads
+        count = 0
+        for (bucket, bucketCount) in enumerate(self.counts):
+            count += bucketCount
+            if count and (count >= target):
+                return min(self.buckets[bucket], self.maxTime) if bucket < len(self.buckets) else self.maxTime
+        return 0.0
+
+    def getStats(self):
+        with self.lock:
+            return {"reads": self.reads,
+                    "errors": self.errors,
+                    "totalTime": self.totalTime,
+                    "meanTime": (self.totalTime / self.reads) if self.reads else 0.0,
+                    "maxTime": self.maxTime,
+                    "p50": self.percentile(.5),
+                    "p95": self.percentile(.95),
+                    "histogram": list(zip(list(self.buckets) + [None], self.counts))}
+
+missingState = object()    # marks a state table entry that has been deleted
+
+# Table of resource states addressed by interned names
+# Each entry records the table version when it was last changed so consumers can find the states
+# that changed since a version without keeping their own copies.
+# It supports the dictionary operations that are used on a dictionary of states.
+class StateTable(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.ids = {}           # index of each name in the table
+        self.names = []         # name of each entry
+        self.values = []        # state of each entry
+        self.versions = []      # table version when each entry was last changed
+        self.changes = collections.deque()  # (version, index) of the entries in the order they were changed
+        self.version = 0
+
+    # return the index of a name, adding an entry if it isn't in the table, must be called with the lock held
+    # the entry is added to the lists before its index is published so readers without the lock never find
+    # an index that isn't in them
+    def getId(self, name):
+        try:
+            return self.ids[name]
+        except KeyError:
+            if isinstance(name, str):
+                name = sys.intern(name)
+            entry = len(self.names)
+            self.names.append(name)
+            self.values.append(missingState)
+            self.versions.append(0)
+            self.ids[name] = entry
+            return entry
+
+    # set a dictionary of states and return the new version of the table
+    def update(self, states, version=None):
+        with self.lock:
+            self.version = self.version + 1 if version is None else version
+            for (name, value) in states.items():
+                entry = self.getId(name)
+                self.values[entry] = value
+                self.versions[entry] = self.version
+                self.changes.append((self.version, entry))
+            # drop the records of entries that changed again once they make up most of the log
+            if len(self.changes) > 2 * len(self.names) + 16:
+                self.changes = collections.deque(change for change in self.changes if self.versions[change[1]] == change[0])
+            return self.version
+
+    # return the indexes of the entries that changed after the specified version, must be called with the lock held
+    # all the entries are returned if the specified version is newer than the table
+    def changedEntries(self, since):
+        if (since <= 0) or (since > self.version):
+            return [entry for (entry, version) in enumerate(self.versions) if version > 0]
+        entries = []
+        for (version, entry) in reversed(self.changes):
+            if version <= since:
+                break
+            if self.versions[entry] == version:     # the most recent change of the entry
+                entries.append(entry)
+        entries.reverse()
+        return entries
+
+    # return the current version and the names of the entries that changed after the specified version
+    def changedNames(self, since):
+        with self.lock:
+            return (self.version, [self.names[entry] for entry in self.changedEntries(since)])
+
+    # return the current version and the states that changed after the specified version
+    # all the states are returned if the specified version is newer than the table
+    def changedStates(self, since):
+        with self.lock:
+            return (self.version, {self.names[entry]: self.values[entry] for entry in self.changedEntries(since)
+                                    if self.values[entry] is not missingState})
+
+    # return a dictionary interface to the states of a subset of the names
+    def view(self):
+        return StateTableView(self)
+
+    def __getitem__(self, name):
+        value = self.values[self.ids[name]]
+        if value is missingState:
+            raise KeyError(name)
+        return value
+
+    def get(self, name, default=None):
+        try:
+            return self[name]
+        except KeyError:
+            return default
+
+    def __setitem__(self, name, value):
+        self.update({name: value})
+
+    def __delitem__(self, name):
+        self.update({self.names[self.ids[name]]: missingState})
+
+    def __contains__(self, name):
+        return self.get(name, missingState) is not missingState
+
+    def keys(self):
+        return [name for (name, value) in zip(self.names, self.values) if value is not missingState]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def items(self):
+        return list(self.copy().items())
+
+    # return a dictionary of the states
+    def copy(self):
+        with self.lock:
+            return {name: value for (name, value) in zip(self.names, self.values) if value is not missingState}
+
+    __copy__ = copy
+
+# The states of a subset of the names in a StateTable, such as the sensors of an interface
+class StateTableView(object):
+    def __init__(self, table):
+        self.table = table
+        self.members = set()    # names that have been set through this view
+
+    def __getitem__(self, name):
+        if name not in self.members:
+            raise KeyError(name)
+        return self.table[name]
+
+    def get(self, name, default=None):
+        return self.table.get(name, default) if name in self.members else default
+
+    def __setitem__(self, name, value):
+        self.members.add(name)
+        self.table[name] = value
+
+    def update(self, states):
+        self.members.update(states.keys())
+        self.table.update(states)
+
+    def __contains__(self, name):
+        return name in self.members
+
+    def keys(self):
+        return list(self.members)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.members)
+
+    def items(self):
+        return [(name, self.table.get(name)) for name in self.keys()]
+
+    def copy(self):
+        return dict(self.items())
+
+    __copy__ = copy
 
 # Resource collection state cache
 class StateCache(object):
-    def __init__(self, name, resources, event, start=False):
+    def __init__(self, name, resources, event, start=False, workers=None, checkpoint=None):
         self.name = name
         self.resources = resources
         self.resourceEvent = event          # externalresource state change event
         self.stateEvent = threading.Event() # state change event
-        self.states = {}                    # cache of current sensor states
+        self.states = StateTable()          # cache of current sensor states
+        self.stateLock = newLock(name+".states") # serializes updates of the states and the subscriptions
+        self.version = 0                    # incremented every time states change
+        self.subscriptions = []             # consumers of state changes
+        self.changeLog = collections.deque()    # recent (version, name, old state, new state, timestamp) changes
+        self.changeLogSize = stateChangeLogSize # maximum number of changes in the log
+        self.changeLogVersion = 0           # the log contains all changes made after this version
+        self.pollQueue = []                 # heap of [deadline, seq, resource] entries for polled sensors
+        self.pollEntries = {}               # current poll queue entry for each resource by name
+        self.pollSeq = itertools.count()    # tie breaker for entries with the same deadline
+        self.pollCondition = threading.Condition()  # signals the poll thread when the queue changes
+        self.pollIntervals = {}             # current polling interval of sensors with adaptive polling
+        self.derivedResources = {}          # resources whose states are computed from other resources
+        self.reportTimes = {}               # when the state of each resource was last reported as changed
+        self.tableVersions = {}             # version of the state table of each interface that was last read
+        self.heldStates = set()             # resources with a change waiting for their minimum interval
+        self.pollPartitions = {}            # sensors waiting to be read, partitioned by interface
+        self.checkpoint = checkpoint        # file that the states are periodically saved to
+        self.stale = set()                  # resources whose states were loaded from the checkpoint and not read yet
+        self.resourceStats = {}             # read statistics of each resource by name
+        self.interfaceStats = {}            # read statistics of each interface by name
+        self.pollLateness = ReadStats("pollLateness")   # how late the polls run against their deadlines
+        self.pollWorkers = pollWorkers if workers is None else workers
+        if self.pollWorkers:                # read the interfaces in parallel
+            self.pollPool = concurrent.futures.ThreadPoolExecutor(max_workers=self.pollWorkers,
+                                                                  thread_name_prefix=self.name+"-poll")
+        else:                               # read the interfaces serially in the poll thread
+            self.pollPool = None
+        for resource in self.resources.members():
+            self.resourceChanged(resource, True)
+        self.resources.addWatcher(self.resourceChanged)
         if start:
             self.start()
 
     def start(self, notify=None):
         # initialize the resource state cache
         debug("debugStateCache", self.name, "starting")
-        for resource in list(self.resources.values()):
-            if isinstance(resource, Sensor):   # skip resources that don't have a state
-                try:
-                    self.states[resource.name] = resource.getState()    # load the initial state
-                except Exception as ex:
-                    logException(self.name+" start", ex)
+        now = time.monotonic()
+        resources = [resource for resource in self.resources.members() if isinstance(resource, Sensor)]
+        for resource in resources:
+            self.schedulePoll(resource, now + self.pollInterval(resource))
+        if self.checkpoint:
+            # serve the last known states until the resources have been read
+            states = self.loadCheckpoint()
+            with self.stateLock:
+                self.stale = set(name for name in states if name in self.resources)
+            self.updateStates({name: states[name] for name in self.stale}, report=False)
+            startThread("initStatesThread", self.initStates, args=(resources,), notify=notify)
+            startThread("checkpointThread", self.checkpointThread, notify=notify)
+        else:
+            self.initStates(resources)
         self.startTime = time.time()
         startThread("pollStatesThread", self.pollStatesThread, notify=notify)
         startThread("watchEventsThread", self.watchEventsThread, notify=notify)
 
-    # thread to periodically poll the state of the resources in the collection
+    # load the initial states of the resources
+    def initStates(self, resources):
+        debug("debugStateCache", self.name, "reading", len(resources), "initial states")
+        resourceStates = self.readStates(resources)
+        if self.stale:      # only the states that differ from the checkpoint
+            self.updateStates(self.changedStates(resourceStates, "debugStateCache"))
+            # the heartbeats of the states that are the same as the checkpoint start now
+            now = time.monotonic()
+            for resourceName in resourceStates.keys():
+                self.reportTimes.setdefault(resourceName, now)
+        else:
+            self.updateStates(resourceStates)
+        debug("debugStateCache", self.name, "initial states loaded")
+
+    # return the states that were saved in the checkpoint file
+    def loadCheckpoint(self):
+        try:
+            with open(self.checkpoint) as checkpointFile:
+                states = json.load(checkpointFile)
+            debug("debugStateCache", self.name, "loaded", len(states), "states from", self.checkpoint)
+            return states
+        except FileNotFoundError:
+            return {}
+        except Exception as ex:
+            log(self.name, "unable to load checkpoint", self.checkpoint, type(ex).__name__, str(ex))
+            return {}
+
+    # periodically save the states if they have changed
+    # the file is replaced atomically so a crash can't leave a partial checkpoint
+    def checkpointThread(self):
+        debug("debugStateCache", self.name, "starting checkpointThread", self.checkpoint)
+        checkpointVersion = None
+        while True:
+            time.sleep(stateCheckpointInterval)
+            (version, states) = self.getSnapshot()
+            if version == checkpointVersion:
+                continue
+            try:
+                tmpFileName = self.checkpoint+".tmp"
+                with open(tmpFileName, "w") as checkpointFile:
+                    json.dump(states, checkpointFile)
+                    checkpointFile.flush()
+                    os.fsync(checkpointFile.fileno())
+                os.replace(tmpFileName, self.checkpoint)
+                checkpointVersion = version
+                debug("debugStateCache", self.name, "saved", len(states), "states to", self.checkpoint)
+            except Exception as ex:
+                log(self.name, "unable to save checkpoint", self.checkpoint, type(ex).__name__, str(ex))
+
+    # a resource was added to or deleted from the collection
+    def resourceChanged(self, resource, added):
+        if added:
+            if isinstance(resource, Sensor):
+                self.schedulePoll(resource, time.monotonic(), replace=False)   # poll it as soon as possible
+                if type(resource).getState is not Sensor.getState:
+                    self.derivedResources[resource.name] = resource
+                else:
+                    self.derivedResources.pop(resource.name, None)
+        else:
+            if self.derivedResources.get(resource.name) is resource:
+                del self.derivedResources[resource.name]
+            self.resourceStats.pop(resource.name, None)
+            self.pollIntervals.pop(resource.name, None)
+            with self.pollCondition:
+                try:
+                    if self.pollEntries[resource.name][2] is resource:
+                        del self.pollEntries[resource.name]     # the queue entry will be discarded when it is due
+                except KeyError:
+                    pass
+
+    # return the polling interval of a resource in seconds
+    def pollInterval(self, resource):
+        return max(self.pollIntervals.get(resource.name, resource.poll), 1 / pollResolution)
+
+    # adjust the polling interval of a sensor with adaptive polling
+    # the interval is stretched toward maxPoll while the state doesn't change
+    # and drops back to minPoll as soon as it does
+    def adaptPollInterval(self, resource, changed):
+        if not resource.maxPoll:
+            return
+        minPoll = resource.minPoll if resource.minPoll else resource.poll
+        if changed:
+            interval = minPoll
+        else:
+            interval = min(self.pollIntervals.get(resource.name, minPoll) * pollBackoff, resource.maxPoll)
+        if interval != self.pollIntervals.get(resource.name):
+            if traceFlags.debugStateCachePoll:
+                trace("debugStateCachePoll", self.name, resource.name, "poll interval", interval)
+            self.pollIntervals[resource.name] = interval
+
+    # put a resource into the poll queue with the specified deadline
+    # if replace is False an existing entry for the same resource is left alone
+    def schedulePoll(self, resource, deadline, replace=True):
+        with self.pollCondition:
+            if (not replace) and (resource.name in self.pollEntries) and \
+                    (self.pollEntries[resource.name][2] is resource):
+                return
+            entry = [deadline, next(self.pollSeq), resource]
+            self.pollEntries[resource.name] = entry
+            heapq.heappush(self.pollQueue, entry)
+            if self.pollQueue[0] is entry:      # the poll thread may be sleeping past this deadline
+                self.pollCondition.notify()
+
+    # put a polled entry back into the queue with its next deadline unless the resource was deleted meanwhile
+    def reschedulePoll(self, entry, deadline):
+        with self.pollCondition:
+            if self.pollEntries.get(entry[2].name) is entry:
+                entry[0] = deadline
+                entry[1] = next(self.pollSeq)
+                heapq.heappush(self.pollQueue, entry)
+                if self.pollQueue[0] is entry:
+                    self.pollCondition.notify()
+
+    # wait until at least one resource is due to be polled and return the list of due queue entries
+    def getDuePolls(self):
+        with self.pollCondition:
+            while True:
+                now = time.monotonic()
+                if self.pollQueue and (self.pollQueue[0][0] <= now):
+                    break
+                self.pollCondition.wait((self.pollQueue[0][0] - now) if self.pollQueue else None)
+            entries = []
+            while self.pollQueue and (self.pollQueue[0][0] <= now):
+                entry = heapq.heappop(self.pollQueue)
+                if self.pollEntries.get(entry[2].name) is entry:   # skip entries of deleted or replaced resources
+                    entries.append(entry)
+            return entries
+
+    # thread to poll the state of the resources in the collection when each one is due
     def pollStatesThread(self):
-        debug("debugStateCachePoll", self.name, "starting pollStatesThread")
-        resourcePollCounts = {}
+        debug("debugStateCachePoll", self.name, "starting pollStatesThread", "workers:", self.pollWorkers)
         while True:
-            stateChanged = False
-            debug("debugStateCachePoll", self.name, "polling", len(self.resources), "resources")
-            with self.resources.lock:
-                for resource in list(self.resources.values()):
-                    try:
-                        if isinstance(resource, Sensor) and \
-                                (resource.enabled) and (not resource.event):            # only poll enabled sensors without events
-                            if resource.name not in list(resourcePollCounts.keys()):    # a resource not seen before
-                                resourcePollCounts[resource.name] = resource.poll * pollResolution
-                                self.states[resource.name] = resource.getState()
-                                stateChanged = True
-                            if resourcePollCounts[resource.name] == 0:                  # count has decremented to zero
-                                resourceState = resource.getState()
-                                if resourceState != self.states[resource.name]:         # save the state if it has changed
-                                    debug("debugStateCachePoll", self.name, resource.name,
-                                                "changed from", self.states[resource.name], "to", resourceState)
-                                    self.states[resource.name] = resourceState
-                                    stateChanged = True
-                                resourcePollCounts[resource.name] = resource.poll * pollResolution
-                            else:   # decrement the count
-                                resourcePollCounts[resource.name] -= 1
-                    except KeyError:
-                        log(self.name, "no previous state", resource.name)
-                    except Exception as ex:
-                        logException(self.name+" pollStates", ex)
-            if stateChanged:    # at least one resource state changed
-                self.stateEvent.set()
-                stateChanged = False
-            time.sleep(1 / pollResolution)
+            entries = self.getDuePolls()
+            if traceFlags.debugStateCachePoll:
+                trace("debugStateCachePoll", self.name, "polling", len(entries), "resources")
+            # sensors on the same interface are read serially by the partition for that interface
+            partitionEntries = {}
+            for entry in entries:
+                interface = entry[2].interface
+                try:
+                    partitionEntries[id(interface)][1].append(entry)
+                except KeyError:
+                    partitionEntries[id(interface)] = (interface, [entry])
+            for (key, (interface, entries)) in partitionEntries.items():
+                try:
+                    partition = self.pollPartitions[key]
+                except KeyError:
+                    partition = PollPartition(interface.name if interface else "noInterface")
+                    self.pollPartitions[key] = partition
+                if partition.queue(entries):    # the partition isn't already being read
+                    if self.pollPool:
+                        self.pollPool.submit(self.pollPartition, partition)
+                    else:
+                        self.pollPartition(partition)
+
+    # read the sensors that are queued for a partition until there are none left
+    def pollPartition(self, partition):
+        entries = []
+        stopped = False
+        try:
+            while True:
+                entries = partition.take()
+                if not entries:
+                    stopped = True      # take() stopped the partition
+                    break
+                partition.readTime = time.monotonic()
+                for (deadline, seq, resource) in entries:
+                    partition.logLag(partition.readTime - deadline)
+                    self.pollLateness.record(partition.readTime - deadline)
+                # only poll enabled sensors without events
+                # and event driven sensors that have a change waiting for their minimum interval to pass
+                resourceStates = self.readStates([resource for (deadline, seq, resource) in entries
+                                                    if (resource.enabled) and
+                                                       ((not resource.event) or (resource.name in self.heldStates))])
+                partition.readTime = None
+                changedStates = self.changedStates(resourceStates, "debugStateCachePoll")
+                for resourceName in resourceStates.keys():
+                    resource = self.resources.get(resourceName)
+                    if resource is not None:
+                        self.adaptPollInterval(resource, (resourceName in self.heldStates) or
+                                                         ((resourceName in changedStates) and
+                                                          (changedStates[resourceName] != self.states.get(resourceName))))
+                # schedule the next poll relative to the deadline so the interval doesn't drift
+                # but don't try to catch up if the poll is running late
+                now = time.monotonic()
+                (rescheduled, entries) = (entries, [])
+                for entry in rescheduled:
+                    self.reschedulePoll(entry, max(entry[0] + self.pollInterval(entry[2]), now))
+                self.updateStates(changedStates)
+        except Exception as ex:
+            logException(self.name+" pollPartition "+partition.name, ex)
+            # the sensors that were taken but not rescheduled would never be polled again
+            partition.readTime = None
+            now = time.monotonic()
+            for entry in entries:
+                self.reschedulePoll(entry, now + self.pollInterval(entry[2]))
+        finally:
+            if not stopped:     # let the next poll start a worker for the partition
+                partition.stop()
+
+    # return the states that should be reported as changes from a dictionary of states that were read
+    # changes that are within the deadband of a sensor or that are too soon after its last reported change
+    # are ignored, and a state is reported again if it hasn't been reported for the heartbeat interval
+    def changedStates(self, resourceStates, debugName):
+        changedStates = {}
+        now = time.monotonic()
+        if self.stale:
+            with self.stateLock:
+                self.stale.difference_update(resourceStates.keys())
+        for (resourceName, resourceState) in resourceStates.items():
+            resource = self.resources.get(resourceName)
+            if (resourceName in self.states) and isinstance(resource, Sensor):
+                lastState = self.states[resourceName]
+                sinceReport = now - self.reportTimes.get(resourceName, 0.0)
+                if (resourceState == lastState) or self.inDeadband(resource, lastState, resourceState):
+                    if (not resource.heartbeat) or (sinceReport < resource.heartbeat):
+                        continue
+                elif resource.minInterval and (sinceReport < resource.minInterval):
+                    # hold the change and read the sensor again when the interval is over
+                    self.heldStates.add(resourceName)
+                    self.schedulePoll(resource, now - sinceReport + resource.minInterval)
+                    continue
+            if getattr(traceFlags, debugName):
+                trace(debugName, self.name, resourceName, "changed from", self.states.get(resourceName), "to", resourceState)
+            changedStates[resourceName] = resourceState
+            self.heldStates.discard(resourceName)
+        return changedStates
+
+    # return True if the difference between two states of a sensor is within its deadband
+    def inDeadband(self, resource, lastState, state):
+        if (not resource.deadband) and (not resource.relDeadband):
+            return False
+        try:
+            change = abs(state - lastState)
+            deadband = max(resource.deadband or 0, abs(lastState) * (resource.relDeadband or 0))
+        except TypeError:   # not numeric
+            return False
+        return change <= deadband
+
+    # read the states of a list of resources and return them in a dictionary by name
+    # plain sensors on the same interface are read with a single call to the interface
+    def readStates(self, resources):
+        states = {}
+        batches = {}
+        for resource in resources:
+            if (resource.interface) and (resource.enabled) and (type(resource).getState is Sensor.getState):
+                try:
+                    batches[id(resource.interface)].append(resource)
+                except KeyError:
+                    batches[id(resource.interface)] = [resource]
+            else:
+                self.readState(resource, states)
+        for sensors in batches.values():
+            if len(sensors) == 1:
+                self.readState(sensors[0], states)
+            else:
+                self.readBatch(sensors, states)
+        return states
+
+    # read the states of sensors on the same interface with one call into a dictionary of states
+    # sensors with maxAge that were read recently reuse their values and the others are locked while they are
+    # read, the same as in Sensor.readCached()
+    def readBatch(self, sensors, states):
+        sensors = self.reuseCached(sensors, states)
+        # lock in a consistent order so batches that overlap can't deadlock
+        locks = sorted((sensor.getReadLock() for sensor in sensors if sensor.maxAge), key=id)
+        for lock in locks:
+            lock.acquire()
+        try:
+            sensors = self.reuseCached(sensors, states)     # read by another caller while this one was waiting
+            if not sensors:
+                return
+            interface = sensors[0].interface
+            readTime = time.monotonic()
+            try:
+                values = interface.readMany([sensor.addr for sensor in sensors])
+                for (sensor, value) in zip(sensors, values):
+                    if sensor.maxAge:
+                        sensor.cacheValue(value)
+                    states[sensor.name] = sensor.convertState(value)
+            except Exception as ex:     # read them one at a time
+                self.logReadTime(interface, None, readTime, True)
+                logException(self.name+" readMany "+interface.name, ex)
+                for sensor in sensors:
+                    self.readState(sensor, states, True)
+                return
+        finally:
+            for lock in locks:
+                lock.release()
+        # the time of the batch is shared by the sensors in it
+        self.logReadTime(interface, None, readTime)
+        elapsed = (time.monotonic() - readTime) / len(sensors)
+        for sensor in sensors:
+            self.getReadStats(self.resourceStats, sensor.name).record(elapsed)
+
+    # put the states of sensors that have fresh values into a dictionary of states and return the other sensors
+    def reuseCached(self, sensors, states):
+        unread = []
+        for sensor in sensors:
+            if sensor.isFresh():
+                states[sensor.name] = sensor.convertState(sensor.readValue)
+            else:
+                unread.append(sensor)
+        return unread
+
+    # read the state of a resource into a dictionary of states
+    # locked is True if the caller holds the read lock of the sensor so the interface is read directly
+    def readState(self, resource, states, locked=False):
+        readTime = time.monotonic()
+        try:
+            if locked and resource.maxAge:
+                resource.cacheValue(resource.interface.read(resource.addr))
+                states[resource.name] = resource.convertState(resource.readValue)
+            else:
+                states[resource.name] = resource.getState()
+            self.logReadTime(resource.interface, resource, readTime)
+        except Exception as ex:
+            self.logReadTime(resource.interface, resource, readTime, True)
+            logException(self.name+" readState "+resource.name, ex)
+
+    # record the time since a read of a resource or an interface was started
+    def logReadTime(self, interface, resource, readTime, error=False):
+        elapsed = time.monotonic() - readTime
+        if resource:
+            self.getReadStats(self.resourceStats, resource.name).record(elapsed, error)
+        if interface:
+            self.getReadStats(self.interfaceStats, interface.name).record(elapsed, error)
+
+    # return the read statistics for a name, creating them if necessary
+    def getReadStats(self, stats, name):
+        try:
+            return stats[name]
+        except KeyError:
+            return stats.setdefault(name, ReadStats(name))
+
+    # return the read statistics of all the resources and interfaces and the poll lateness
+    def getStats(self):
+        return {"resources": {name: stats.getStats() for (name, stats) in list(self.resourceStats.items())},
+                "interfaces": {name: stats.getStats() for (name, stats) in list(self.interfaceStats.items())},
+                "pollLateness": self.pollLateness.getStats()}
+
+    # return the statistics of the resources that take the most time to read in descending order
+    def slowSensors(self, count=10, key="totalTime"):
+        stats = [(name, stats.getStats()) for (name, stats) in list(self.resourceStats.items())]
+        return sorted(stats, key=lambda item: item[1][key], reverse=True)[:count]
+
+    # return a printable report of the resources that take the most time to read
+    def slowSensorReport(self, count=10, key="totalTime"):
+        lines = ["%-32s %8s %6s %10s %10s %10s %10s" % ("resource", "reads", "errors", "total", "mean", "p95", "max")]
+        for (name, stats) in self.slowSensors(count, key):
+            lines.append("%-32s %8d %6d %10.3f %10.4f %10.4f %10.4f" % (name, stats["reads"], stats["errors"],
+                         stats["totalTime"], stats["meanTime"], stats["p95"], stats["maxTime"]))
+        lateness = self.pollLateness.getStats()
+        lines.append("poll lateness: mean %.4f p95 %.4f max %.4f" % (lateness["meanTime"], lateness["p95"], lateness["maxTime"]))
+        return "\n".join(lines)
+
+    # return how late the polls of each interface are running in seconds
+    def getPollLag(self):
+        return {partition.name: partition.getLag() for partition in list(self.pollPartitions.values())}
 
     # thread to watch for state change events
     def watchEventsThread(self):
         debug("debugStateCacheEvent", self.name, "starting watchEventsThread")
         while True:
-            debug("debugStateCacheEvent", self.name, "waiting for", len(self.resources), "resources")
-            self.resourceEvent.clear()
+            if traceFlags.debugStateCacheEvent:
+                trace("debugStateCacheEvent", self.name, "waiting for", len(self.resources), "resources")
             self.resourceEvent.wait()
-            debug("debugStateCacheEvent", self.name, "state change event")
-            stateChanged = False
-            with self.resources.lock:
-                for resource in list(self.resources.values()):
-                    try:
-                        if resource.event:                                      # only get resources with events
-                            resourceState = resource.getState()
-                            if resourceState != self.states[resource.name]:     # save the state if it has changed
-                                debug("debugStateCacheEvent", self.name, resource.name,
-                                            "changed from", self.states[resource.name], "to", resourceState)
-                                self.states[resource.name] = resourceState
-                                stateChanged = True
-                    except KeyError:                                            # resource hasn't been seen before, save the state
-                        self.states[resource.name] = resourceState
-                    except Exception as ex:
-                        logException(self.name+" watchEvents", ex)
-            if stateChanged:    # at least one resource state changed
-                self.stateEvent.set()
-                stateChanged = False
+            self.resourceEvent.clear()
+            if isinstance(self.resourceEvent, ResourceEvent):
+                (sources, unknown) = self.resourceEvent.takeSources()
+            else:                       # the event doesn't identify its source
+                (sources, unknown) = ([], True)
+            resources = None if unknown else self.eventResources(sources)
+            if resources is None:       # read all the resources
+                debug("debugStateCacheEvent", self.name, "state change event from unknown source")
+                resources = self.resources.members()
+            else:
+                trace("debugStateCacheEvent", self.name, "state change event from", lambda: [str(source) for source in sources])
+            # only get resources with events
+            resourceStates = self.readStates([resource for resource in resources
+                                                if isinstance(resource, Sensor) and resource.event])
+            self.updateStates(self.changedStates(resourceStates, "debugStateCacheEvent"))
+
+    # return the resources in the collection that need to be read because of notifications from the
+    # specified sources, or None if a source can't be resolved and all resources must be read
+    def eventResources(self, sources):
+        resources = {}
+        for source in sources:
+            if isinstance(source, Sensor):          # the sensor itself
+                sensors = [source]
+            elif isinstance(source, Interface):     # sensors on the interface
+                sensors = self.changedSensors(source)
+            else:
+                return None
+            for sensor in sensors:
+                if self.resources.get(sensor.name) is sensor:
+                    resources[sensor.name] = sensor
+        # resources that compute their states from other resources may depend on any of them
+        for resource in list(self.derivedResources.values()):
+            resources[resource.name] = resource
+        return list(resources.values())
+
+    # return the sensors on an interface that need to be read after it notified
+    # if the interface keeps its states in a StateTable only the entries that changed since it was last read
+    # are returned, otherwise all of them
+    def changedSensors(self, interface):
+        if not isinstance(interface.states, StateTableView):
+            return list(interface.sensors.values())
+        (version, names) = interface.states.table.changedNames(self.tableVersions.get(id(interface), 0))
+        self.tableVersions[id(interface)] = version
+        return [interface.sensorAddrs[addr] for addr in names if addr in interface.sensorAddrs]
+
+    # save states that have changed and pass them on to the subscribers
+    # report is False if the states weren't read from the resources, such as the states of the checkpoint
+    def updateStates(self, changedStates, report=True):
+        if changedStates:
+            if report:      # the heartbeat and minimum interval of each state start when it is reported
+                now = time.monotonic()
+                for name in changedStates.keys():
+                    self.reportTimes[name] = now
+            with self.stateLock:
+                self.version += 1
+                # log the changes and discard the oldest ones
+                changeTime = time.time()
+                for (name, state) in changedStates.items():
+                    self.changeLog.append((self.version, name, self.states.get(name), state, changeTime))
+                while len(self.changeLog) > self.changeLogSize:
+                    self.changeLogVersion = self.changeLog.popleft()[0]
+                self.states.update(changedStates, self.version)
+                for subscription in self.subscriptions:
+                    subscription.put(self.version, changedStates)
+            self.stateEvent.set()
+
+    # return the current version and a list of (version, name, old state, new state, timestamp) changes
+    # made after the specified version
+    # the list is None if the changes are no longer in the log or the specified version is newer than the cache
+    # and a full snapshot must be taken
+    def getChanges(self, since):
+        with self.stateLock:
+            if (since < self.changeLogVersion) or (since > self.version):
+                return (self.version, None)
+            changes = []
+            for change in reversed(self.changeLog):
+                if change[0] <= since:
+                    break
+                changes.append(change)
+            changes.reverse()
+            return (self.version, changes)
+
+    # return the current version and the current states of the sensors that changed after the specified version
+    # unlike getChanges() this doesn't depend on the change log
+    def getChangedStates(self, since):
+        with self.stateLock:
+            return self.states.changedStates(since)
+
+    # return True if the state of the resource was loaded from the checkpoint and hasn't been read yet
+    def isStale(self, name):
+        return name in self.stale
+
+    # return the current version and a copy of all the states
+    def getSnapshot(self):
+        with self.stateLock:
+            return (self.version, copy.copy(self.states))
+
+    # return a subscription that receives the states that change in the cache
+    # the first batch of changes returned by the subscription contains all the current states
+    def subscribe(self, name):
+        with self.stateLock:
+            subscription = StateSubscription(name)
+            subscription.put(self.version, copy.copy(self.states))
+            self.subscriptions.append(subscription)
+        debug("debugStateCache", self.name, "subscribed", name)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.stateLock:
+            self.subscriptions.remove(subscription)
+        debug("debugStateCache", self.name, "unsubscribed", subscription.name)
 
     # wait for a change and return the current state of all sensors in the resource collection
+    # consumers that need to see every change should use a subscription instead
     def getStates(self, wait=True):
         if wait:
             self.stateEvent.clear()
             self.stateEvent.wait()
-        return copy.copy(self.states)
+        with self.stateLock:
+            return copy.copy(self.states)
 
     # set the state of the specified sensor in the cache
     def setState(self, sensor, state):
-        self.states[sensor.name] = state
+        self.updateStates({sensor.name: state})
 
     # set state values of all sensors into the cache
     def setStates(self, states):
-        for sensor in list(states.keys()):
-            self.states[sensor] = states[sensor]
+        self.updateStates(states)
+
+# The states that have changed in a StateCache since a subscriber last asked for them
+# Changes are merged until they are taken so a slow subscriber only sees the latest state of each sensor
+class StateSubscription(object):
+    def __init__(self, name):
+        self.name = name
+        self.condition = threading.Condition()
+        self.changedStates = {}     # states that have changed since the last get()
+        self.version = 0            # cache version of the last changes that were returned
+        self.latestVersion = 0      # cache version of the latest changes
+
+    def put(self, version, changedStates):
+        with self.condition:
+            self.changedStates.update(changedStates)
+            self.latestVersion = version
+            self.condition.notify_all()
+
+    # optionally wait for changes and return the cache version and the states that changed
+    # returns an empty dictionary if wait is False or the timeout expires without any changes
+    def get(self, wait=True, timeout=None):
+        with self.condition:
+            if wait:
+                self.condition.wait_for(lambda: self.changedStates, timeout)
+            (changedStates, self.changedStates) = (self.changedStates, {})
+            self.version = self.latestVersion
+            return (self.version, changedStates)
 
 # Compare two state dictionaries and return a dictionary containing the items
 # whose values don't match or aren't in the old dict.